@@ -0,0 +1,37 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+from asyncio import coroutine, get_event_loop
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+AUTH_POOL_SIZE = int(os.environ.get('AUTH_POOL_SIZE', min(4, os.cpu_count() or 1)))
+
+executor = ThreadPoolExecutor(max_workers=POOL_SIZE)
+# Password hashing gets its own, smaller pool: at most AUTH_POOL_SIZE logins run at once,
+# the rest queue here instead of taking the threads token-authenticated requests need
+auth_executor = ThreadPoolExecutor(max_workers=AUTH_POOL_SIZE)
+
+
+@coroutine
+def run_in(pool, func, *args, **kwargs):
+    loop = get_event_loop()
+    result = yield from loop.run_in_executor(pool, partial(func, *args, **kwargs))
+    return result
+
+
+@coroutine
+def run(func, *args, **kwargs):
+    """ Run blocking (peewee) work on the bounded executor, out of the event loop """
+    result = yield from run_in(executor, func, *args, **kwargs)
+    return result
+
+
+@coroutine
+def run_auth(func, *args, **kwargs):
+    """ Run credential checks, hashing included, on the bounded auth executor """
+    result = yield from run_in(auth_executor, func, *args, **kwargs)
+    return result
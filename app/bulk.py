@@ -0,0 +1,103 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import datetime as dt
+
+import ujson as json
+
+from .models import Note, NoteBook, User, atomic
+from .utils import clean_tags, alias_candidates, fallback_alias
+from .words import RESERVED_ALIASES
+
+
+MAX_ITEMS = 1000
+NDJSON = 'application/x-ndjson'
+
+TEXT_LENGTH = 2**13 - 1
+ALIAS_LENGTH = 63
+NOTEBOOK_LENGTH = 255
+
+
+def parse_notes(body):
+    """ Items of a JSON array or NDJSON body, ValueError if it is malformed """
+    if isinstance(body, bytes):
+        body = body.decode('utf-8')
+    body = body.strip()
+    if body.startswith('['):
+        items = json.loads(body)
+    else:
+        items = [json.loads(line) for line in body.splitlines() if line.strip()]
+    if not items:
+        raise ValueError('No data')
+    if len(items) > MAX_ITEMS:
+        raise ValueError('Too many notes, {} at most'.format(MAX_ITEMS))
+    return items
+
+
+def check_item(item):
+    if not isinstance(item, dict):
+        return 'Note must be an object'
+    text = item.get('text')
+    if not text or not isinstance(text, str) or len(text) > TEXT_LENGTH:
+        return 'Text is required, {} characters at most'.format(TEXT_LENGTH)
+    alias = item.get('alias')
+    if alias is not None and (not isinstance(alias, str) or len(alias) > ALIAS_LENGTH):
+        return 'Alias must be a string of {} characters at most'.format(ALIAS_LENGTH)
+    if alias in RESERVED_ALIASES:
+        return 'Alias is reserved'
+    notebook = item.get('notebook')
+    if notebook is not None and (not isinstance(notebook, str) or len(notebook) > NOTEBOOK_LENGTH):
+        return 'Notebook must be a string of {} characters at most'.format(NOTEBOOK_LENGTH)
+
+
+def free_alias(taken):
+    for alias in alias_candidates():
+        if alias not in taken:
+            return alias
+    return fallback_alias()
+
+
+def import_notes(owner, items):
+    """ Insert the valid items in one transaction, return a status per item """
+    taken = Note.aliases(owner, active=True)
+    statuses, rows = [], []
+    for item in items:
+        problem = check_item(item)
+        if problem:
+            statuses.append({'status': 'error', 'error': problem})
+            continue
+        alias = item.get('alias') or free_alias(taken)
+        if alias in taken:
+            statuses.append({'status': 'error', 'alias': alias, 'error': 'Alias must be unique'})
+            continue
+        taken.add(alias)
+        notebook = item.get('notebook')
+        rows.append({
+            'owner': owner,
+            'text': item['text'],
+            'html': clean_tags(item['text']),
+            'alias': alias,
+            'active': True,
+            'notebook': NoteBook.get_or_create(notebook) if notebook else None,
+        })
+        statuses.append({'status': 'created', 'alias': alias})
+    if rows:
+        with atomic(Note):
+            # stamped once sanitizing and notebook lookups are done, just before the rows go in
+            version, now = User.bump(owner.id), dt.datetime.now()
+            for row in rows:
+                row.update(created=now, updated=now, version=version)
+            Note.purge(owner, [row['alias'] for row in rows])
+            Note.bulk_insert(rows)
+    return statuses
+
+
+def ndjson(items):
+    return ''.join(json.dumps(item) + '\n' for item in items)
+
+
+def summary(statuses):
+    """ Response body and status code of an import """
+    if any(item['status'] == 'created' for item in statuses):
+        return {'status': 'ok', 'notes': statuses}, 201
+    return {'status': 'error', 'error': 'No notes imported', 'notes': statuses}, 400
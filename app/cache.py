@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .metrics import collector
+
+
+class LRUCache(object):
+    """ Bounded in-process LRU cache with an optional time to live """
+
+    def __init__(self, size=1024, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        """ Live entry test that neither counts as a hit nor refreshes the entry """
+        entry = self._data.get(key)
+        return entry is not None and (entry[0] is None or entry[0] >= time.time())
+
+    def get(self, key, default=None):
+        if not self.size:
+            return default
+        with self._lock:
+            try:
+                expire, value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expire is not None and expire < time.time():
+                self.misses += 1
+                return default
+            self._data[key] = (expire, value)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if not self.size:
+            return
+        expire = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expire, value)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def evict(self, predicate):
+        """ Drop every entry whose value matches the predicate """
+        with self._lock:
+            for key, (_, value) in list(self._data.items()):
+                if predicate(value):
+                    del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': float(self.hits) / total if total else 0.0}
+
+
+SECRET = os.urandom(32)
+
+credentials = LRUCache(size=int(os.environ.get('AUTH_CACHE_SIZE', 1024)),
+                       ttl=int(os.environ.get('AUTH_CACHE_TTL', 300)))
+# a cached token is not checked against the database, so its ttl bounds how long a deactivation
+# or a revocation made by another process keeps being served
+tokens = LRUCache(size=int(os.environ.get('TOKEN_CACHE_SIZE', 4096)),
+                  ttl=int(os.environ.get('TOKEN_CACHE_TTL', 30)))
+user_agents = LRUCache(size=int(os.environ.get('UA_CACHE_SIZE', 256)))
+notebooks = LRUCache(size=int(os.environ.get('NOTEBOOK_CACHE_SIZE', 4096)))
+
+CACHES = {
+    'credentials': credentials,
+    'tokens': tokens,
+    'user_agents': user_agents,
+    'notebooks': notebooks,
+}
+
+
+def credentials_key(header):
+    """ Keyed digest of the basic auth header, plaintext never stored
+
+    It maps to the (user id, password hash) the header was verified against,
+    a hit is only trusted while the stored hash is still the same.
+    """
+    return hmac.new(SECRET, header, hashlib.sha256).digest()
+
+
+def forget_user(user):
+    """ Invalidate everything cached for the user """
+    credentials.evict(lambda cached: cached[0] == user.id)
+    tokens.evict(lambda cached: cached.user.id == user.id)
+
+
+def stats():
+    return {name: cache.stats() for name, cache in CACHES.items()}
+
+
+@collector
+def cache_metrics():
+    stats_ = stats()
+    return [
+        ('noteit_cache_hits_total', 'counter', 'Cache hits.',
+         [({'cache': name}, value['hits']) for name, value in stats_.items()]),
+        ('noteit_cache_misses_total', 'counter', 'Cache misses.',
+         [({'cache': name}, value['misses']) for name, value in stats_.items()]),
+        ('noteit_cache_entries', 'gauge', 'Cached entries.',
+         [({'cache': name}, value['size']) for name, value in stats_.items()]),
+    ]
@@ -0,0 +1,174 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Maintenance commands shared by both backends
+
+    python manage.py django backfill_html
+    python manage.py muffin backfill_html 1000
+"""
+
+import datetime as dt
+import importlib
+import os
+import re
+import subprocess
+import sys
+import time
+
+BASE_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+COMMANDS = {}
+
+
+def command(func=None, standalone=False):
+    """ Register a command, standalone ones get the backend module name instead of a loaded backend """
+    def register(func):
+        func.standalone = standalone
+        COMMANDS[func.__name__] = func
+        return func
+    return register(func) if func else register
+
+
+def run_command(backend, name, args):
+    func = COMMANDS[name]
+    if func.standalone:
+        return func(backend, *args)
+    importlib.import_module(backend)
+    return func(*args)
+
+
+@command
+def backfill_html(batch_size=500):
+    """ Store the sanitized rendition of notes written before it existed """
+    from .models import Note
+
+    total = 0
+    while True:
+        done = Note.backfill_html(int(batch_size))
+        if not done:
+            break
+        total += done
+    print('{} notes sanitized'.format(total))
+
+
+@command
+def sweep_tokens(batch_size=500, pause=0.1):
+    """ Delete expired tokens in small batches, pausing between them to keep locks short """
+    from .models import Token
+
+    total = 0
+    while True:
+        done = Token.sweep(int(batch_size))
+        total += done
+        if done < int(batch_size):
+            break
+        time.sleep(float(pause))
+    print('{} expired tokens deleted'.format(total))
+
+
+@command
+def compact_notes(days=30, batch_size=200, pause=0.2):
+    """ Purge notes deleted more than the given days ago, in short transactions with pauses between """
+    from .models import Note
+
+    retention = dt.timedelta(days=float(days))
+    total = 0
+    while True:
+        done = Note.compact(retention, int(batch_size))
+        total += done
+        if done < int(batch_size):
+            break
+        time.sleep(float(pause))
+    print('{} deleted notes purged'.format(total))
+
+
+def explain(query):
+    """ sqlite query plan details of a Django queryset or peewee query, table aliases resolved """
+    from .models import DJANGO
+
+    if DJANGO:
+        from django.db import connection
+        sql, params = query.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            rows = cursor.fetchall()
+    else:
+        sql, params = query.sql()
+        rows = query.model_class._meta.database.execute_sql('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+    # peewee names its tables t1, t2..., which sqlite 3.36+ reports in place of the table
+    aliases = dict((alias, table) for table, alias in TABLE_ALIAS.findall(sql))
+    return [PLAN_TABLE.sub(lambda match: match.group(1) + aliases.get(match.group(2), match.group(2)), row[-1])
+            for row in rows]
+
+
+TABLE_ALIAS = re.compile(r'"(\w+)" AS "?(\w+)"?')
+PLAN_TABLE = re.compile(r'^((?:SCAN|SEARCH) (?:TABLE )?)(\w+)')
+BAD_PLAN = re.compile(r'^SCAN (TABLE )?(note|notebook)\b|TEMP B-TREE')
+
+
+@command
+def check_query_plans():
+    """ EXPLAIN the note hot paths on sqlite, fail on full scans and temp sorts """
+    from .models import DJANGO, Note, NoteBook, User
+
+    owner = User(id=1)
+    cursor = (dt.datetime.now(), 1)
+    queries = {
+        'notes': Note.keyset(Note.listing(owner), cursor),
+        'notes?all': Note.keyset(Note.listing(owner, everything=True), cursor),
+        'notebook': Note.keyset(Note.listing(owner, 'name'), cursor),
+        'note': Note.by_alias(owner, 'alias'),
+        'changes': Note.changes(owner, (0, 1)),
+    }
+    if DJANGO:
+        queries['notebook name'] = NoteBook.objects.filter(name='name')
+    else:
+        queries['notebook name'] = NoteBook.select().where(NoteBook.name == 'name')
+    failed = False
+    for name, query in sorted(queries.items()):
+        plan = explain(query)
+        bad = [detail for detail in plan if BAD_PLAN.search(detail)]
+        failed = failed or bool(bad)
+        print('{:10} {:4} {}'.format(name, 'FAIL' if bad else 'ok', '; '.join(plan)))
+    if failed:
+        sys.exit(1)
+
+
+@command
+def search_index(action='create'):
+    """ Create and fill, or drop, the full-text index where the migrations do not manage the schema """
+    from .models import Note, execute, vendor
+    from .search import SETUP, TEARDOWN
+
+    kind = vendor(Note)
+    for sql in (SETUP if action == 'create' else TEARDOWN)[kind]:
+        execute(Note, sql)
+    print('{} full-text index {}d'.format(kind, 'drop' if action == 'drop' else action))
+
+
+HEAVY_MODULES = ('bleach', 'user_agents', 'ua_parser', 'faker')
+STARTUP_BUDGET_MS = int(os.environ.get('STARTUP_BUDGET_MS', 1000))  # 0 only reports
+
+
+@command(standalone=True)
+def startup_time(backend, runs=5, budget=STARTUP_BUDGET_MS):
+    """ Cold import time of the backend in fresh interpreters, fail over the budget (ms) """
+    code = ('import sys, time; start = time.time(); import {}; elapsed = time.time() - start; '
+            'print(elapsed, *[name for name in {!r} if name in sys.modules])').format(backend, HEAVY_MODULES)
+    times, eager = [], set()
+    for _ in range(int(runs)):
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=BASE_DIR).decode().split()
+        times.append(float(output[0]) * 1000)
+        eager.update(output[1:])
+    times.sort()
+    median = times[len(times) // 2]
+    print('{} cold start: median {:.0f} ms, min {:.0f} ms, max {:.0f} ms over {} runs'.format(
+        backend, median, times[0], times[-1], len(times)))
+    failed = False
+    if eager:
+        failed = True
+        print('imported eagerly: {}'.format(', '.join(sorted(eager))))
+    if float(budget) and median > float(budget):
+        failed = True
+        print('over the {} ms budget'.format(budget))
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,55 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import gzip
+import io
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5))
+# Bodies bigger than this are compressed off the muffin event loop
+OFFLOAD_SIZE = int(os.environ.get('COMPRESS_OFFLOAD_SIZE', 64 * 1024))
+
+
+def _accepted(accept_encoding):
+    codings = {}
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            codings[coding.strip().lower()] = quality
+    return codings
+
+
+def choose_encoding(accept_encoding, size):
+    """ Content coding for a body of the size, None to send it as is """
+    if size < MIN_SIZE:
+        return None
+    codings = _accepted(accept_encoding)
+    if brotli is not None and codings.get('br', 0) > 0:
+        return 'br'
+    if codings.get('gzip', codings.get('*', 0)) > 0:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=LEVEL, mtime=0) as stream:
+        stream.write(body)
+    return buf.getvalue()
@@ -3,20 +3,23 @@
 
 import os
 import sys
+import time
+from functools import wraps
+from itertools import chain
 from types import ModuleType
 
 import ujson as json
-from user_agents import parse
 
 import django
 from django.conf.urls import url
 from django.core.wsgi import get_wsgi_application
 from django.views.generic import View, TemplateView
-from django.http import HttpResponse, JsonResponse, Http404
-from django.forms import ModelForm, CharField
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse, Http404
+from django.forms import ModelForm, BooleanField, CharField, ValidationError
 from django.views.decorators.http import require_POST, require_GET
 from django.db.utils import IntegrityError
 from django.apps.config import AppConfig
+from django.utils.cache import patch_vary_headers
 
 BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
 sys.path.append(BASE_DIR)
@@ -24,8 +27,13 @@ sys.path.append(BASE_DIR)
 import app
 __package__ = 'app'
 
-from .utils import clean_tags, USER_AGENT_HEADER, HTTP_HEADER_ENCODING
+from .compression import choose_encoding, compress
+from . import metrics
+from .pagination import (CURSOR_HEADER, OFFSET_HEADER, STREAM_PAGE_SIZE, page_size, page_offset,
+                         encode_cursor, decode_cursor, encode_change_cursor, decode_change_cursor, json_stream)
+from .utils import is_browser, etag, etag_matches, HTTP_HEADER_ENCODING
 from .middlewares import basic_auth_handler, token_auth_handler
+from .words import RESERVED_ALIASES
 
 
 APP_LABEL = __package__
@@ -49,13 +57,17 @@ class Settings(ModuleType):
     ALLOWED_HOSTS = os.environ.get('ALLOWED_HOSTS', 'localhost').split(',')
 
     DATABASES = {
-        'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(BASE_DIR, 'notes.db')}
+        'default': {'ENGINE': 'django.db.backends.sqlite3',
+                    'NAME': os.environ.get('NOTES_DB', os.path.join(BASE_DIR, 'notes.db'))}
     }
     ROOT_URLCONF = __name__
     MIGRATION_MODULES = {APP_LABEL: 'migrations'}
     INSTALLED_APPS = (app,)
+    SILENCED_SYSTEM_CHECKS = ['fields.W342']  # Token.user is unique but keeps the User.tokens manager
 
     MIDDLEWARE_CLASSES = (
+        APP_LABEL + '.' + FILE + '.MetricsMiddleware',
+        APP_LABEL + '.' + FILE + '.CompressionMiddleware',
         APP_LABEL + '.' + FILE + '.TokenAuthentication',
         APP_LABEL + '.' + FILE + '.BasicAuthMiddleware',
         'django.middleware.security.SecurityMiddleware',
@@ -67,10 +79,9 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
 
 django.setup()
 
-from .models import Note, Report, User, Token, NoteBook
-
-
-OTHER = 'Other'
+from .models import Note, Report, User, Token, NoteBook, CursorExpired
+from .bulk import NDJSON, parse_notes, import_notes, summary, ndjson
+from .reports import reports
 
 
 def get_limit():
@@ -79,15 +90,22 @@ def get_limit():
 
 class NoteForm(ModelForm):
     _notebook = CharField(max_length=255, required=False)
+    _overwrite = BooleanField(required=False)
 
     class Meta:
         model = Note
-        fields = ['text', 'alias', '_notebook']
+        fields = ['text', 'alias', '_notebook', '_overwrite']
     
     def __init__(self, *args, **kwargs):
         super(NoteForm, self).__init__(*args, **kwargs)
         self.fields['alias'].required = False
 
+    def clean_alias(self):
+        alias = self.cleaned_data.get('alias')
+        if alias in RESERVED_ALIASES:
+            raise ValidationError('Alias is reserved')
+        return alias
+
 
 class ReportForm(ModelForm):
 
@@ -100,24 +118,59 @@ def error(msg):
     return {'status': 'error', 'error': msg}
 
 
+def conditional(view):
+    """ Tag the view's 200s with the user's notes version, answer 304 before any note is read """
+    @wraps(view)
+    def wrapper(self, request, *args, **kwargs):
+        tag = etag(request.user.id, User.version_of(request.user), request.get_full_path(),
+                   is_browser(request.META.get('HTTP_USER_AGENT', '')))
+        if etag_matches(request.META.get('HTTP_IF_NONE_MATCH'), tag):
+            response = HttpResponseNotModified()
+        else:
+            response = view(self, request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = tag
+        return response
+    return wrapper
+
+
 class NotesView(View):
 
     def get_queryset(self):
-        if 'all' in self.request.GET:
-            return self.request.user.notes.filter(active=True)
-        if 'notebook' in self.request.GET:
-            return self.request.user.notes.filter(active=True,
-                                                  notebook__name=self.request.GET['notebook'])[:get_limit()]
-        return self.request.user.notes.filter(active=True, notebook__isnull=True)[:get_limit()]
+        return Note.listing(self.request.user, self.request.GET.get('notebook'), 'all' in self.request.GET)
 
     def get(self, request, **kwargs):
+        if 'all' in request.GET:
+            return self.stream()
+        return self.page(request)
+
+    @conditional
+    def page(self, request):
+        try:
+            cursor = decode_cursor(request.GET.get('cursor'))
+        except ValueError:
+            return JsonResponse(error('Invalid cursor'), status=400)
+
         status = 200
-        notes = self.get_queryset()
+        notes, next_cursor = Note.page(self.get_queryset(), cursor,
+                                       page_size(request.GET.get('limit'), get_limit()))
         response = [note.as_dict() for note in notes]
         if not response:
             response = error('No notes')
             status = 204
-        return JsonResponse(response, status=status, safe=False)
+        with metrics.SERIALIZE.time():
+            response = JsonResponse(response, status=status, safe=False)
+        if next_cursor:
+            response[CURSOR_HEADER] = encode_cursor(next_cursor)
+        return response
+
+    def stream(self):
+        pages = Note.pages(self.get_queryset(), STREAM_PAGE_SIZE)
+        first = next(pages)
+        if not first:
+            return JsonResponse(error('No notes'), status=204)
+        pages = ([note.as_dict() for note in notes] for notes in chain([first], pages))
+        return StreamingHttpResponse(json_stream(pages), content_type='application/json')
 
     def post(self, request, **kwargs):
         status = 400
@@ -132,29 +185,94 @@ class NotesView(View):
                 'owner': request.user
             }
 
+            overwrite = form.cleaned_data.get('_overwrite') and data['alias']
             if not data['alias']:
-                del data['alias']
+                data['alias'] = Note.free_alias(request.user)
             if data.get('_notebook'):
                 data['notebook'] = NoteBook.get_or_create(data.pop('_notebook'))
             else:
                 del data['_notebook']
+            if overwrite:
+                if Note.upsert(**data):
+                    return JsonResponse({'status': 'ok', 'result': 'created'}, status=201)
+                return JsonResponse({'status': 'ok', 'result': 'replaced'}, status=200)
             try:
-                Note.objects.create(**data)
+                Note.add(**data)
             except IntegrityError:
                 status = 406
                 response = error('Alias must be unique, use -o option to overwrite')
             else:
                 response = {'status': 'ok'}
+        elif 'alias' in form.errors:
+            response = error(form.errors['alias'][0])
         return JsonResponse(response, status=status)
 
 
 class NotebookView(NotesView):
 
     def get_queryset(self):
-        qs = self.request.user.notes.filter(active=True, notebook__name=self.kwargs['name'])
-        return qs[:get_limit()]
+        return Note.listing(self.request.user, self.kwargs['name'])
     
 
+class BulkView(View):
+
+    def get(self, request, **kwargs):
+        pages = Note.pages(Note.listing(request.user, everything=True), STREAM_PAGE_SIZE)
+        return StreamingHttpResponse((ndjson(note.as_dict() for note in notes) for notes in pages),
+                                     content_type=NDJSON)
+
+    def post(self, request, **kwargs):
+        try:
+            items = parse_notes(request.body)
+        except ValueError as exc:
+            return JsonResponse(error(str(exc)), status=400)
+        try:
+            response, status = summary(import_notes(request.user, items))
+        except IntegrityError:
+            response, status = error('Alias must be unique, retry the import'), 409
+        return JsonResponse(response, status=status)
+
+
+class ChangesView(View):
+
+    def get(self, request, **kwargs):
+        try:
+            cursor = decode_change_cursor(request.GET.get('since'))
+        except ValueError:
+            return JsonResponse(error('Invalid cursor'), status=400)
+        try:
+            notes, cursor = Note.change_page(request.user, cursor, page_size(request.GET.get('limit'), get_limit()))
+        except CursorExpired:
+            return JsonResponse(error('Cursor expired, sync again without since'), status=410)
+        if notes:
+            with metrics.SERIALIZE.time():
+                response = JsonResponse([note.as_change() for note in notes], safe=False)
+        else:
+            response = JsonResponse(error('No changes'), status=204)
+        if cursor:
+            response[CURSOR_HEADER] = encode_change_cursor(cursor)
+        return response
+
+
+class SearchView(View):
+
+    @conditional
+    def get(self, request, **kwargs):
+        query = request.GET.get('q', '').strip()
+        if not query:
+            return JsonResponse(error('Query is required'), status=400)
+        limit = page_size(request.GET.get('limit'), get_limit())
+        offset = page_offset(request.GET.get('offset'))
+        notes = Note.search(request.user, query, limit, offset)
+        if not notes:
+            return JsonResponse(error('No notes'), status=204)
+        with metrics.SERIALIZE.time():
+            response = JsonResponse([note.as_dict() for note in notes], safe=False)
+        if len(notes) == limit:
+            response[OFFSET_HEADER] = str(offset + limit)
+        return response
+
+
 class NoteView(View):
 
     @property
@@ -163,39 +281,48 @@ class NoteView(View):
         if not alias:
             raise Http404
         try:
-            return self.request.user.notes.filter(alias=alias, active=True).get()
+            return Note.by_alias(self.request.user, alias).get()
         except Note.DoesNotExist:
             raise Http404
 
+    @conditional
     def get(self, request, **kwargs):
-        response = self.note.as_dict()
-        ua = parse(request.META.get(USER_AGENT_HEADER, ''))
-        if ua.device.family != OTHER or ua.browser.family != OTHER:
-            response = clean_tags(response['text'])
+        note = self.note
+        if is_browser(request.META.get('HTTP_USER_AGENT', '')):
+            response = note.as_html()
             ct = None
         else:
-            response = json.dumps(response)
+            with metrics.SERIALIZE.time():
+                response = json.dumps(note.as_dict())
             ct = 'application/json'
         return HttpResponse(response, content_type=ct)
 
     def delete(self, *args, **kwargs):
-        self.note.delete()
+        if not Note.soft_delete(self.request.user, self.kwargs.get('alias')):
+            raise Http404
         return JsonResponse({'status': 'ok'}, status=204)
 
 
+@require_POST
+def restore_note(request, alias):
+    if not Note.restore(request.user, alias):
+        raise Http404
+    return JsonResponse({'status': 'ok'})
+
+
 @require_POST
 def report_view(request):
     status = 400
     response = error('No data')
     form = ReportForm(request.POST)
     if form.is_valid():
-        report = form.instance
-        if hasattr(request, 'user') and request.user:
-            report.user = request.user
-        report.info = request.META.get('HTTP_USER_AGENT', '')
-        report.save()
         status = 201
         response = {'status': 'ok'}
+        if not reports.submit(traceback=form.cleaned_data['traceback'],
+                              info=request.META.get('HTTP_USER_AGENT', ''),
+                              user=getattr(request, 'user', None) or None):
+            status = 503
+            response = error('Too many reports, try later')
     return JsonResponse(response, status=status)
 
 
@@ -206,10 +333,15 @@ def get_token(request):
 
 @require_POST
 def drop_token(request):
-    request.user.token.delete()
+    Token.revoke(request.user)
     return JsonResponse({'status': 'ok'}, status=202)
 
 
+@require_GET
+def metrics_view(request):
+    return HttpResponse(metrics.expose(), content_type=metrics.CONTENT_TYPE)
+
+
 @require_GET
 def get_install_script(request):
     with open(os.path.join(BASE_DIR, 'install.sh')) as script:
@@ -218,6 +350,10 @@ def get_install_script(request):
 
 urlpatterns = [
     url(r'^notes/?$', NotesView.as_view()),
+    url(r'^notes/bulk/?$', BulkView.as_view()),
+    url(r'^notes/search/?$', SearchView.as_view()),
+    url(r'^notes/changes/?$', ChangesView.as_view()),
+    url(r'^notes/(?P<alias>.{1,30})/restore/?$', restore_note),
     url(r'^notes/(?P<alias>.{1,30})/?$', NoteView.as_view()),
     url(r'^notebook/(?P<name>.{1,30})/?$', NotebookView.as_view()),
     
@@ -225,11 +361,23 @@ urlpatterns = [
     url(r'^get_token/?$', get_token, name='get_token'),
     url(r'^drop_tokens/?$', drop_token, name='drop_token'),
 
+    url(r'^metrics/?$', metrics_view, name='metrics'),
     url(r'^install\.sh$', get_install_script),
 ]
 
 
-application = get_wsgi_application()
+class LazyApplication(object):
+    """ WSGI entry point, Django's handler is built on the first request """
+    handler = None
+
+    def __call__(self, environ, start_response):
+        if self.handler is None:
+            self.handler = get_wsgi_application()
+        return self.handler(environ, start_response)
+
+
+application = LazyApplication()
+metrics.instrument_django()
 
 
 class BasicAuthMiddleware:
@@ -257,14 +405,48 @@ class BasicAuthMiddleware:
         realm = 'Basic realm="%s"' % realm 
         return cls.not_auth(realm)
 
+    @staticmethod
+    def too_many(retry_after):
+        response = HttpResponse(status=429)
+        response['Retry-After'] = str(retry_after)
+        return response
+
     def process_request(self, request):
         if hasattr(request, 'user'):
             return
         auth = self.get_authorization(request)
-        request = basic_auth_handler(request, auth, self.not_auth_base, self.set_user, User)
+        request = basic_auth_handler(request, auth, self.not_auth_base, self.set_user, User,
+                                     self.too_many, request.META.get('REMOTE_ADDR'))
         return request 
 
 
+class MetricsMiddleware:
+
+    def process_request(self, request):
+        request._started = time.time()
+
+    def process_response(self, request, response):
+        started = getattr(request, '_started', None)
+        if started is not None:
+            metrics.REQUESTS.observe(time.time() - started, route=metrics.route(request.path),
+                                     method=request.method, status=response.status_code)
+        return response
+
+
+class CompressionMiddleware:
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING'), len(response.content))
+        if encoding:
+            response.content = compress(response.content, encoding)
+            response['Content-Encoding'] = encoding
+            response['Content-Length'] = str(len(response.content))
+        return response
+
+
 class TokenAuthentication(BasicAuthMiddleware):
 
     @classmethod
@@ -0,0 +1,152 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" In-process metrics in the Prometheus text exposition format """
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from .words import RESERVED_ALIASES
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+ROUTES = {'notes': 'alias', 'notebook': 'name', 'report': None, 'get_token': None, 'drop_tokens': None,
+          'install.sh': None, 'metrics': None}
+STATIC_SEGMENTS = RESERVED_ALIASES
+
+METRICS = []
+COLLECTORS = []
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('"', '\\"')) for key, value in pairs) + '}'
+
+
+class Histogram(object):
+    """ Latency histogram with arbitrary labels """
+
+    def __init__(self, name, help, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, **labels):
+        return timer(self, **labels)
+
+    def expose(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        for key, counts, total in sorted(series):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(self.name, _labels(key + (('le', bound),)), cumulative))
+            lines.append('{}_sum{} {}'.format(self.name, _labels(key), total))
+            lines.append('{}_count{} {}'.format(self.name, _labels(key), cumulative))
+        return lines
+
+
+@contextmanager
+def timer(histogram, **labels):
+    start = time.time()
+    try:
+        yield
+    finally:
+        histogram.observe(time.time() - start, **labels)
+
+
+def timed(histogram, **labels):
+    """ Decorator observing the duration of every call """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.time() - start, **labels)
+        return wrapper
+    return decorator
+
+
+def collector(func):
+    """ Register a function returning (name, type, help, [(labels, value)]) families """
+    COLLECTORS.append(func)
+    return func
+
+
+def expose():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.expose())
+    for func in COLLECTORS:
+        for name, kind, help, samples in func():
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for labels, value in samples:
+                lines.append('{}{} {}'.format(name, _labels(sorted(labels.items())), value))
+    return '\n'.join(lines) + '\n'
+
+
+def route(path):
+    """ Low cardinality route label of a request path """
+    parts = [part for part in path.split('/') if part]
+    if not parts:
+        return '/'
+    if parts[0] not in ROUTES:
+        return 'other'
+    label = '/' + parts[0]
+    if len(parts) > 1:
+        if parts[1] in STATIC_SEGMENTS:
+            label += '/' + parts[1]
+        else:
+            label += '/{%s}' % (ROUTES[parts[0]] or 'param')
+    if len(parts) > 2:
+        label += '/' + '/'.join(parts[2:3])
+    return label
+
+
+REQUESTS = Histogram('noteit_request_duration_seconds', 'Request latency by route, method and status.')
+AUTH = Histogram('noteit_auth_duration_seconds', 'Time spent authenticating, by step (hash or lookup).')
+DB = Histogram('noteit_db_query_duration_seconds', 'Database query latency, its count is the number of queries.')
+SANITIZE = Histogram('noteit_sanitize_duration_seconds', 'Time spent sanitizing note html.')
+SERIALIZE = Histogram('noteit_serialize_duration_seconds', 'Time spent serializing response bodies.')
+
+
+def instrument_django():
+    """ Time every query that goes through Django cursors """
+    from django.db.backends import utils
+    if getattr(utils.CursorWrapper, '_instrumented', False):
+        return
+    utils.CursorWrapper.execute = timed(DB)(utils.CursorWrapper.execute)
+    utils.CursorWrapper.executemany = timed(DB)(utils.CursorWrapper.executemany)
+    utils.CursorWrapper._instrumented = True
+
+
+def instrument_peewee():
+    """ Time every query that goes through peewee databases """
+    import peewee
+    if getattr(peewee.Database, '_instrumented', False):
+        return
+    peewee.Database.execute_sql = timed(DB)(peewee.Database.execute_sql)
+    peewee.Database._instrumented = True
@@ -3,6 +3,8 @@
 
 import base64
 
+from .cache import credentials, credentials_key, tokens
+from .throttle import attempt
 from .utils import HTTP_HEADER_ENCODING
 
 
@@ -10,7 +12,22 @@ def non_private_zone(request):
     return request.path.split('/')[1] not in ['notes', 'drop_tokens', 'get_token', 'notebook']
 
 
-def basic_auth_handler(request, auth, not_auth, set_user, user_model):
+def verified_recently(auth):
+    """ Whether the basic auth header is cached, checking it then takes a lookup but no hashing """
+    return bool(auth) and len(auth) == 2 and credentials_key(auth[1]) in credentials
+
+
+def basic_username(auth):
+    """ Username of a well formed basic auth header, None for anything else """
+    if not auth or len(auth) != 2 or auth[0].lower() != b'basic':
+        return
+    try:
+        return base64.b64decode(auth[1]).decode(HTTP_HEADER_ENCODING).partition(':')[0]
+    except (TypeError, ValueError):
+        return
+
+
+def basic_auth_handler(request, auth, not_auth, set_user, user_model, too_many=None, address=None):
     User = user_model
     if non_private_zone(request):
         return
@@ -23,10 +40,17 @@ def basic_auth_handler(request, auth, not_auth, set_user, user_model):
 
     try:
         auth_parts = base64.b64decode(auth[1]).decode(HTTP_HEADER_ENCODING).partition(':')
-    except (TypeError, UnicodeDecodeError):
+    except (TypeError, ValueError):
         return not_auth('Invalid basic header.')
 
     username, password = auth_parts[0], auth_parts[2]
+    key = credentials_key(auth[1])
+    cached = credentials.get(key)
+    if cached is None and too_many is not None:
+        wait = attempt(address, username)
+        if wait:
+            return too_many(wait)
+
     user = User.get(username=username)
 
     if user is None:
@@ -34,12 +58,16 @@ def basic_auth_handler(request, auth, not_auth, set_user, user_model):
         user.set_password(password)
         user.save()
     else:
-        if not user.check_password(password):
+        # the hash is skipped only while the stored one is what the header was checked against,
+        # so password changes made by any other process still take effect at once
+        if cached != (user.id, user.password) and not user.check_password(password):
             return not_auth('Invalid username/password.')
 
         if not user.active:
             return not_auth('User inactive or deleted.')
 
+    if cached != (user.id, user.password):
+        credentials.set(key, (user.id, user.password))
     set_user(request, user)
 
 
@@ -64,6 +92,10 @@ def token_auth_handler(request, auth, not_auth, set_user, token_model):
     if not token:
         return not_auth('Invalid token.')
 
+    if token.expired:
+        tokens.delete(key)
+        return not_auth('Token expired.')
+
     if not token.user.active:
         return not_auth('User inactive or deleted.')
 
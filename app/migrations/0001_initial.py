@@ -5,7 +5,7 @@ from __future__ import unicode_literals
 import datetime
 from django.db import migrations, models
 import django.db.models.deletion
-import utils
+from app import utils
 
 
 class Migration(migrations.Migration):
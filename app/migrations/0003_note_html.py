@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_auto_20160210_0637'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='html',
+            field=models.TextField(null=True),
+        ),
+    ]
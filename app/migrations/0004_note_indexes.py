@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_note_html'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='note',
+            index_together=set([('owner', 'notebook', 'active', 'created'), ('owner', 'active', 'created')]),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def merge_duplicates(apps, schema_editor):
+    NoteBook = apps.get_model('app', 'NoteBook')
+    Note = apps.get_model('app', 'Note')
+    seen = {}
+    for notebook in NoteBook.objects.order_by('id'):
+        if notebook.name in seen:
+            Note.objects.filter(notebook_id=notebook.id).update(notebook_id=seen[notebook.name])
+            notebook.delete()
+        else:
+            seen[notebook.name] = notebook.id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_note_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='notebook',
+            name='name',
+            field=models.CharField(max_length=8191, unique=True),
+        ),
+    ]
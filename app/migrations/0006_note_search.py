@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from app import search
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_notebook_unique_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(search.create_index, search.drop_index),
+    ]
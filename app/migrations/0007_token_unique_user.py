@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def drop_duplicates(apps, schema_editor):
+    Token = apps.get_model('app', 'Token')
+    seen = set()
+    for token in Token.objects.order_by('user_id', '-created'):
+        if token.user_id in seen:
+            token.delete()
+        else:
+            seen.add(token.user_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_note_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='token',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tokens',
+                                    to='app.User', unique=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='token',
+            index_together=set([('created',)]),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+
+from django.db import migrations, models
+
+
+def stamp_inactive(apps, schema_editor):
+    Note = apps.get_model('app', 'Note')
+    Note.objects.filter(active=False, deleted=None).update(deleted=datetime.datetime.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_token_unique_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='deleted',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(stamp_inactive, migrations.RunPython.noop),
+        migrations.AlterIndexTogether(
+            name='note',
+            index_together=set([('owner', 'notebook', 'active', 'created'), ('owner', 'active', 'created'),
+                                ('active', 'deleted')]),
+        ),
+    ]
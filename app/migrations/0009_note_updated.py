@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_updated(apps, schema_editor):
+    Note = apps.get_model('app', 'Note')
+    Note.objects.update(updated=F('created'))
+    Note.objects.filter(active=False).exclude(deleted=None).update(updated=F('deleted'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_note_deleted'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='updated',
+            field=models.DateTimeField(default=datetime.datetime.now),
+        ),
+        migrations.RunPython(backfill_updated, migrations.RunPython.noop),
+        migrations.AlterIndexTogether(
+            name='note',
+            index_together=set([('owner', 'notebook', 'active', 'created'), ('owner', 'active', 'created'),
+                                ('active', 'deleted'), ('owner', 'updated')]),
+        ),
+    ]
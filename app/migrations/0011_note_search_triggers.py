@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from app import search
+
+
+class Migration(migrations.Migration):
+    """ 0008 and 0009 rebuilt the note table on sqlite, which dropped the full-text triggers """
+
+    dependencies = [
+        ('app', '0010_user_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(search.create_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from app import search
+
+
+class Migration(migrations.Migration):
+    """ Existing notes keep version 0: they sort before every later write, by id among themselves """
+
+    dependencies = [
+        ('app', '0011_note_search_triggers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='version',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterIndexTogether(
+            name='note',
+            index_together=set([('owner', 'notebook', 'active', 'created'), ('owner', 'active', 'created'),
+                                ('active', 'deleted'), ('owner', 'version')]),
+        ),
+        # the AddField rebuilt note on sqlite, see search.py
+        migrations.RunPython(search.create_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_note_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='horizon',
+            field=models.IntegerField(default=0),
+        ),
+    ]
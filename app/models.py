@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import datetime as dt
+import os
 
 
 try:
@@ -11,13 +12,102 @@ try:
 except (ImportError, ImproperlyConfigured):
     DJANGO = False
     import peewee as models
+    from peewee import IntegrityError
     models.ForeignKey = models.ForeignKeyField
     APP_LABEL = None
 else:
     DJANGO = True
-    from django.db import models
+    from django.db import models, transaction, IntegrityError
+    from django.db.models import Q
+    from django.utils.dateparse import parse_datetime
 
-from .utils import gen_key, get_alias, generate_password_hash, check_password_hash
+from .cache import forget_user, notebooks, tokens
+from .metrics import AUTH, timed
+from .search import SEARCH, search_params
+from .utils import (gen_key, get_alias, alias_candidates, fallback_alias, generate_password_hash,
+                    check_password_hash, clean_tags)
+
+
+TOKEN_TTL = int(os.environ.get('TOKEN_TTL', 30 * 24 * 3600))  # seconds, 0 never expires
+
+# Create the user's token or replace it once expired, the unique user_id makes it race free
+ISSUE_TOKEN = (
+    "INSERT INTO token (key, user_id, created) VALUES (%s, %s, %s) "
+    "ON CONFLICT (user_id) DO UPDATE SET "
+    "key = CASE WHEN token.created < %s THEN excluded.key ELSE token.key END, "
+    "created = CASE WHEN token.created < %s THEN excluded.created ELSE token.created END "
+    "RETURNING key, created"
+)
+
+
+# Create the note or overwrite the owner's note with that alias, a deleted one counts as new
+UPSERT_NOTE = (
+    "INSERT INTO note (text, html, owner_id, alias, active, created, updated, version, deleted, notebook_id) "
+    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NULL, %s) "
+    "ON CONFLICT (owner_id, alias) DO UPDATE SET "
+    "text = excluded.text, html = excluded.html, notebook_id = excluded.notebook_id, "
+    "created = CASE WHEN note.active THEN note.created ELSE excluded.created END, "
+    "updated = excluded.updated, version = excluded.version, active = excluded.active, deleted = NULL "
+    "RETURNING created = %s"
+)
+
+# Count a write to the user's notes, run first in the transaction of the write: the row lock it takes
+# orders the user's writers, so versions become visible in the order they were handed out
+BUMP_VERSION = 'UPDATE "user" SET version = version + 1 WHERE id = %s RETURNING version'
+
+# Move the user's horizon up to the version of a note about to be purged, never down
+RAISE_HORIZON = 'UPDATE "user" SET horizon = %s WHERE id = %s AND horizon < %s'
+
+
+def atomic(model):
+    """ Transaction block on the model's database, a savepoint when nested """
+    if DJANGO:
+        return transaction.atomic()
+    return database(model).atomic()
+
+
+class Unchanged(Exception):
+    """ Raised inside atomic() to roll back a write that matched nothing, the version bump included """
+
+
+class CursorExpired(Exception):
+    """ The changes cursor is behind a purged deletion, the client has to sync again from the start """
+
+
+def bulk_insert(model, rows, batch_size=100):
+    """ Insert rows (dicts of field values) in one transaction with batched INSERTs """
+    if DJANGO:
+        with transaction.atomic():
+            model.objects.bulk_create([model(**row) for row in rows], batch_size=batch_size)
+    else:
+        with model._meta.database.atomic():
+            for start in range(0, len(rows), batch_size):
+                model.insert_many(rows[start:start + batch_size]).execute()
+
+
+def database(model):
+    db = model._meta.database
+    return getattr(db, 'obj', None) or db  # unwrap muffin_peewee's proxy
+
+
+def vendor(model):
+    """ 'sqlite' or 'postgresql' """
+    if DJANGO:
+        from django.db import connection
+        return connection.vendor
+    return 'postgresql' if isinstance(database(model), models.PostgresqlDatabase) else 'sqlite'
+
+
+def execute(model, sql, params=()):
+    """ Run raw sql with %s placeholders, return the fetched rows """
+    if DJANGO:
+        from django.db import connection
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall() if cursor.description else []
+    db = database(model)
+    cursor = db.execute_sql(sql.replace('%s', db.interpolation), params)
+    return cursor.fetchall() if cursor.description else []
 
 
 class User(models.Model):
@@ -26,6 +116,8 @@ class User(models.Model):
     password = models.CharField(max_length=30)
     active = models.BooleanField(default=True)
     created = models.DateTimeField(default=dt.datetime.now)
+    version = models.IntegerField(default=0)  # notes writes, validates cached listings, only bump writes it
+    horizon = models.IntegerField(default=0)  # version of the latest purged note, only purges write it
     __module__ = '__main__'  # django hack stuff
 
     class Meta:
@@ -41,24 +133,51 @@ class User(models.Model):
     def pk(self):
         return self.id
 
+    def save(self, *args, **kwargs):
+        if self.id is not None:  # a copy loaded before a note write must not roll the version back
+            if DJANGO:
+                kwargs.setdefault('update_fields', [field.name for field in self._meta.concrete_fields
+                                                    if field.name not in ('id', 'version', 'horizon')])
+            else:
+                kwargs.setdefault('only', [field for field in self._meta.sorted_fields
+                                           if field.name not in ('id', 'version', 'horizon')])
+        result = super(User, self).save(*args, **kwargs)
+        forget_user(self)
+        return result
+
+    @timed(AUTH, step='hash')
     def set_password(self, password):
         self.password = generate_password_hash(password)
 
+    @timed(AUTH, step='hash')
     def check_password(self, password):
         return check_password_hash(password, self.password)
 
     @property
     def token(self):
-        try:
-            token = self.tokens.get()
-        except Token.DoesNotExist:
-            if DJANGO:
-                token = Token.objects.create(user=self)
-            else:
-                token = Token.create(user=self)
-        return token
+        return Token.issue(self)
+
+    @classmethod
+    def bump(cls, user_id):
+        """ Count a write to the user's notes, return the new version """
+        return execute(cls, BUMP_VERSION, [user_id])[0][0]
 
     @classmethod
+    def version_of(cls, user):
+        """ The stored notes version, the user object may come from a cache """
+        if DJANGO:
+            return cls.objects.filter(id=user.id).values_list('version', flat=True).first()
+        return cls.select(cls.version).where(cls.id == user.id).scalar()
+
+    @classmethod
+    def horizon_of(cls, user):
+        """ Version of the user's latest purged note, change cursors below it missed a deletion """
+        if DJANGO:
+            return cls.objects.filter(id=user.id).values_list('horizon', flat=True).first()
+        return cls.select(cls.horizon).where(cls.id == user.id).scalar()
+
+    @classmethod
+    @timed(AUTH, step='lookup')
     def get(cls, username):
         if DJANGO:
             return cls.objects.filter(username=username).first()
@@ -70,7 +189,7 @@ class User(models.Model):
 
 class NoteBook(models.Model):
     """ Implement NoteBook models"""
-    name = models.CharField(max_length=2**13-1)
+    name = models.CharField(max_length=2**13-1, unique=True)
 
     __module__ = '__main__'
     
@@ -81,10 +200,16 @@ class NoteBook(models.Model):
 
     @classmethod
     def get_or_create(cls, name):
+        """ Notebook by name, the unique index keeps concurrent creates safe """
+        pk = notebooks.get(name)
+        if pk is not None:
+            return cls(id=pk, name=name)
         if DJANGO:
-            return cls.objects.get_or_create(name=name)[0]
+            notebook = cls.objects.get_or_create(name=name)[0]
         else:
-            return cls.create_or_get(name=name)
+            notebook = cls.create_or_get(name=name)[0]
+        notebooks.set(name, notebook.id)
+        return notebook
 
     class Meta:
         db_table = 'notebook'
@@ -94,10 +219,14 @@ class NoteBook(models.Model):
 class Note(models.Model):
     """ Implement Note models"""
     text = models.CharField(max_length=2**13-1)
+    html = models.TextField(null=True)  # sanitized rendition of text
     owner = models.ForeignKey(User, related_name='notes')
-    alias = models.CharField(max_length=63, default=get_alias) # index=True
+    alias = models.CharField(max_length=63, default=get_alias)
     active = models.BooleanField(default=True)
     created = models.DateTimeField(default=dt.datetime.now)
+    updated = models.DateTimeField(default=dt.datetime.now)  # any write, soft deletes included
+    version = models.IntegerField(default=0)  # owner's version of the last write, keys the changes feed
+    deleted = models.DateTimeField(null=True)
     notebook = models.ForeignKey(NoteBook, related_name='notes', null=True)
     __module__ = '__main__'
 
@@ -106,42 +235,368 @@ class Note(models.Model):
         if DJANGO:
             app_label = APP_LABEL
             unique_together = ('owner', 'alias')
+            index_together = [
+                ('owner', 'notebook', 'active', 'created'),
+                ('owner', 'active', 'created'),
+                ('active', 'deleted'),
+                ('owner', 'version'),
+            ]
             ordering = ['-created']
         else:
             indexes = (
                 (('owner', 'alias'), True),
+                (('owner', 'notebook', 'active', 'created'), False),
+                (('owner', 'active', 'created'), False),
+                (('active', 'deleted'), False),
+                (('owner', 'version'), False),
             )
             order_by = ['-created']
+
+    def save(self, *args, **kwargs):
+        self.html = clean_tags(self.text)
+        with atomic(Note):
+            self.version = User.bump(self.owner_id)
+            self.updated = dt.datetime.now()
+            return super(Note, self).save(*args, **kwargs)
         
     def as_dict(self):
         return {'text': self.text, 'alias': self.alias, 'notebook': getattr(self.notebook, 'name', None)}
 
+    @classmethod
+    def visible(cls, owner):
+        """ Active notes of the owner, their notebook fetched by the same query """
+        if DJANGO:
+            return owner.notes.filter(active=True).select_related('notebook')
+        return (cls.select(cls, NoteBook).join(NoteBook, models.JOIN.LEFT_OUTER)
+                .where((cls.owner == owner) & (cls.active == True)))
+
+    @classmethod
+    def listing(cls, owner, notebook=None, everything=False):
+        """ Active notes of the owner: all of them, a notebook or the ones out of notebooks """
+        notes = cls.visible(owner)
+        if everything:
+            return notes
+        if DJANGO:
+            return notes.filter(notebook__name=notebook) if notebook else notes.filter(notebook=None)
+        return notes.where(NoteBook.name == notebook) if notebook else notes.where(cls.notebook >> None)
+
+    @classmethod
+    def by_alias(cls, owner, alias):
+        if DJANGO:
+            return cls.visible(owner).filter(alias=alias).order_by()
+        return cls.visible(owner).where(cls.alias == alias).order_by()
+
+    @classmethod
+    def add(cls, **fields):
+        """ Create a note, taking over the alias of a deleted one """
+        create = cls.objects.create if DJANGO else cls.create
+        try:
+            return create(**fields)
+        except IntegrityError:
+            if not cls.purge(fields['owner'], [fields['alias']]):
+                raise
+        return create(**fields)
+
+    @classmethod
+    def upsert(cls, owner, text, alias, notebook=None):
+        """ Create or overwrite the note in a single statement, return whether it was created """
+        html = clean_tags(text)
+        with atomic(cls):
+            version, now = User.bump(owner.id), dt.datetime.now()
+            params = [text, html, owner.id, alias, True, now, now, version, getattr(notebook, 'id', None), now]
+            return bool(execute(cls, UPSERT_NOTE, params)[0][0])
+
+    @classmethod
+    def soft_delete(cls, owner, alias):
+        """ Hide the note with a single UPDATE, return whether there was one """
+        return cls._set_active(owner, alias, False)
+
+    @classmethod
+    def restore(cls, owner, alias):
+        """ Undo a delete the compaction did not reach yet """
+        return cls._set_active(owner, alias, True)
+
+    @classmethod
+    def _set_active(cls, owner, alias, active):
+        try:
+            with atomic(cls):
+                version, now = User.bump(owner.id), dt.datetime.now()
+                deleted = None if active else now
+                if DJANGO:
+                    count = cls.objects.filter(owner=owner, alias=alias, active=not active).update(
+                        active=active, deleted=deleted, updated=now, version=version)
+                else:
+                    count = cls.update(active=active, deleted=deleted, updated=now, version=version).where(
+                        (cls.owner == owner) & (cls.alias == alias) & (cls.active == (not active))).execute()
+                if not count:
+                    raise Unchanged  # no note, no new version: ETags of the owner's lists stay valid
+                return count
+        except Unchanged:
+            return 0
+
+    @classmethod
+    def purge(cls, owner, aliases, batch_size=500):
+        """ Drop the owner's deleted notes with these aliases, return how many went """
+        aliases, total = list(aliases), 0
+        for start in range(0, len(aliases), batch_size):
+            batch = aliases[start:start + batch_size]
+            if DJANGO:
+                rows = cls.objects.filter(owner=owner, active=False, alias__in=batch)
+                rows = list(rows.values_list('id', 'owner_id', 'version'))
+            else:
+                rows = list(cls.select(cls.id, cls.owner, cls.version).where(
+                    (cls.owner == owner) & (cls.active == False) & (cls.alias << batch)).tuples())
+            total += cls._drop(rows)
+        return total
+
+    @classmethod
+    def compact(cls, retention, batch_size=200):
+        """ Delete a batch of notes deleted more than retention ago, return the batch size """
+        before = dt.datetime.now() - retention
+        if DJANGO:
+            expired = cls.objects.filter(active=False, deleted__lt=before)
+            rows = list(expired.values_list('id', 'owner_id', 'version')[:batch_size])
+        else:
+            rows = list(cls.select(cls.id, cls.owner, cls.version).where(
+                (cls.active == False) & (cls.deleted < before)).limit(batch_size).tuples())
+        cls._drop(rows)
+        return len(rows)
+
+    @classmethod
+    def _drop(cls, rows):
+        """ Delete deleted notes by (id, owner id, version), moving each owner's horizon up to them """
+        if not rows:
+            return 0
+        horizons = {}
+        for _, owner_id, version in rows:
+            horizons[owner_id] = max(version, horizons.get(owner_id, 0))
+        ids = [row[0] for row in rows]
+        with atomic(cls):
+            for owner_id, version in sorted(horizons.items()):  # user rows first, as the note writers lock them
+                execute(User, RAISE_HORIZON, [version, owner_id, version])
+            if DJANGO:
+                return cls.objects.filter(id__in=ids, active=False).delete()[0]
+            return cls.delete().where((cls.id << ids) & (cls.active == False)).execute()
+
+    @classmethod
+    def keyset(cls, query, cursor=None, limit=50):
+        """ Order the query by (-created, -id) and start it after the cursor """
+        if DJANGO:
+            query = query.order_by('-created', '-id')
+            if cursor:
+                created, pk = cursor
+                query = query.filter(Q(created__lt=created) | Q(created=created, id__lt=pk))
+            return query[:limit]
+        query = query.order_by(cls.created.desc(), cls.id.desc())
+        if cursor:
+            created, pk = cursor
+            query = query.where((cls.created < created) | ((cls.created == created) & (cls.id < pk)))
+        return query.limit(limit)
+
+    @classmethod
+    def changes(cls, owner, cursor=None, limit=50):
+        """ The owner's notes written or deleted after the (version, id) cursor, oldest change first
+
+        Versions are handed out under the owner's row lock and stamped in the same transaction,
+        so a write that commits later never lands behind a cursor a reader already holds.
+        """
+        if DJANGO:
+            query = owner.notes.select_related('notebook').order_by('version', 'id')
+            if cursor:
+                version, pk = cursor
+                # the redundant lower bound lets the (owner, version) index seek past old rows
+                query = query.filter(Q(version__gt=version) | Q(id__gt=pk), version__gte=version)
+            return query[:limit]
+        query = (cls.select(cls, NoteBook).join(NoteBook, models.JOIN.LEFT_OUTER)
+                 .where(cls.owner == owner).order_by(cls.version, cls.id))
+        if cursor:
+            version, pk = cursor
+            query = query.where((cls.version >= version) & ((cls.version > version) | (cls.id > pk)))
+        return query.limit(limit)
+
+    @classmethod
+    def change_page(cls, owner, cursor=None, limit=50):
+        """ A page of changes and the cursor to resume from, the given one when nothing changed
+
+        Raises CursorExpired when a deletion after the cursor was purged. The horizon is read after
+        the page: it moves in the transaction of the purge, so one that came before the page shows.
+        A deleted note holds its version alone, so a cursor at the horizon has seen that deletion.
+        """
+        notes = list(cls.changes(owner, cursor, limit))
+        if cursor and cursor[0] < User.horizon_of(owner):
+            raise CursorExpired
+        if notes:
+            cursor = (notes[-1].version, notes[-1].id)
+        return notes, cursor
+
+    def as_change(self):
+        return dict(self.as_dict(), deleted=not self.active)
+
+    @classmethod
+    def page(cls, query, cursor=None, limit=50):
+        """ Keyset page of the query, return notes and the next cursor """
+        notes = list(cls.keyset(query, cursor, limit + 1))
+        if len(notes) <= limit:
+            return notes, None
+        notes = notes[:limit]
+        return notes, (notes[-1].created, notes[-1].id)
+
+    @classmethod
+    def pages(cls, query, limit=50):
+        """ Walk the whole query page by page """
+        cursor = None
+        while True:
+            notes, cursor = cls.page(query, cursor, limit)
+            yield notes
+            if cursor is None:
+                break
+
+    def as_html(self):
+        if self.html is None:
+            return clean_tags(self.text)
+        return self.html
+
+    @classmethod
+    def search(cls, owner, query, limit=50, offset=0):
+        """ The owner's active notes matching the query, best ranked first """
+        kind = vendor(cls)
+        rows = execute(cls, SEARCH[kind], search_params(kind, owner.id, query, limit, offset))
+        ids = [row[0] for row in rows]
+        if not ids:
+            return []
+        if DJANGO:
+            notes = cls.objects.select_related('notebook').in_bulk(ids)
+        else:
+            query = cls.select(cls, NoteBook).join(NoteBook, models.JOIN.LEFT_OUTER).where(cls.id << ids)
+            notes = dict((note.id, note) for note in query)
+        return [notes[pk] for pk in ids if pk in notes]
+
+    @classmethod
+    def free_alias(cls, owner):
+        """ An alias the owner does not use yet, checked with a single query """
+        candidates = alias_candidates()
+        if DJANGO:
+            taken = set(cls.objects.filter(owner=owner, alias__in=candidates).values_list('alias', flat=True))
+        else:
+            taken = set(note.alias for note in
+                        cls.select(cls.alias).where((cls.owner == owner) & (cls.alias << candidates)))
+        for alias in candidates:
+            if alias not in taken:
+                return alias
+        return fallback_alias()
+
+    @classmethod
+    def aliases(cls, owner, active=None):
+        """ Aliases taken by the owner, inactive notes included unless active is given """
+        if DJANGO:
+            notes = cls.objects.filter(owner=owner)
+            if active is not None:
+                notes = notes.filter(active=active)
+            return set(notes.values_list('alias', flat=True))
+        query = cls.select(cls.alias).where(cls.owner == owner)
+        if active is not None:
+            query = query.where(cls.active == active)
+        return set(note.alias for note in query)
+
+    bulk_insert = classmethod(bulk_insert)
+
+    @classmethod
+    def backfill_html(cls, limit):
+        """ Sanitize a batch of notes stored without html, return the batch size """
+        if DJANGO:
+            notes = list(cls.objects.filter(html__isnull=True).only('id', 'text')[:limit])
+            with transaction.atomic():
+                for note in notes:
+                    cls.objects.filter(pk=note.pk).update(html=clean_tags(note.text))
+        else:
+            notes = list(cls.select(cls.id, cls.text).where(cls.html >> None).limit(limit))
+            with cls._meta.database.atomic():
+                for note in notes:
+                    cls.update(html=clean_tags(note.text)).where(cls.id == note.id).execute()
+        return len(notes)
+
 
 class Token(models.Model):
     """ Store tokens for auth"""
     key = models.CharField(max_length=40, default=gen_key, primary_key=True)
-    user = models.ForeignKey(User, related_name='tokens')
+    user = models.ForeignKey(User, related_name='tokens', unique=True)
     created = models.DateTimeField(default=dt.datetime.now)
     __module__ = '__main__'
 
     class Meta:
         app_label = APP_LABEL
         db_table = 'token'
+        if DJANGO:
+            index_together = [('created',)]
+        else:
+            indexes = ((('created',), False),)
 
     def __unicode__(self):
         return self.key
 
     __str__ = __unicode__
 
+    @staticmethod
+    def expiry():
+        """ Tokens created before this moment are expired """
+        if not TOKEN_TTL:
+            return dt.datetime.min
+        return dt.datetime.now() - dt.timedelta(seconds=TOKEN_TTL)
+
+    @property
+    def expired(self):
+        return self.created < self.expiry()
+
+    @classmethod
+    def issue(cls, user):
+        """ The user's live token, fetched, created or renewed in a single statement """
+        now, expiry = dt.datetime.now(), cls.expiry()
+        key, created = execute(cls, ISSUE_TOKEN, [gen_key(), user.id, now, expiry, expiry])[0]
+        if not isinstance(created, dt.datetime):
+            created = parse_datetime(created) if DJANGO else cls.created.python_value(created)
+        return cls(key=key, user=user, created=created)
+
+    @classmethod
+    def revoke(cls, user):
+        tokens.evict(lambda cached: cached.user.id == user.id)
+        if DJANGO:
+            cls.objects.filter(user=user).delete()
+        else:
+            cls.delete().where(cls.user == user).execute()
+
+    @classmethod
+    def sweep(cls, batch_size=500):
+        """ Delete one batch of expired tokens, return how many went """
+        if not TOKEN_TTL:
+            return 0
+        expiry = cls.expiry()
+        if DJANGO:
+            keys = list(cls.objects.filter(created__lt=expiry).values_list('key', flat=True)[:batch_size])
+            if keys:
+                cls.objects.filter(key__in=keys).delete()
+        else:
+            keys = [token.key for token in cls.select(cls.key).where(cls.created < expiry).limit(batch_size)]
+            if keys:
+                cls.delete().where(cls.key << keys).execute()
+        for key in keys:
+            tokens.delete(key)
+        return len(keys)
+
     @classmethod
     def get_by_key(cls, key):
+        token = tokens.get(key)
+        if token is not None:
+            return token
         try:
-            if DJANGO:
-                return cls.objects.select_related('user').get(key=key)
-            else:
-                return cls.select(cls, User).join(User).where(cls.key == key).get()  # TODO 
+            with AUTH.time(step='lookup'):
+                if DJANGO:
+                    token = cls.objects.select_related('user').get(key=key)
+                else:
+                    token = cls.select(cls, User).join(User).where(cls.key == key).get()  # TODO 
         except cls.DoesNotExist:  
             return
+        tokens.set(key, token)
+        return token
 
 
 class Report(models.Model):
@@ -160,6 +615,8 @@ class Report(models.Model):
             order_by = ['-created']
         db_table = 'report'
 
+    bulk_insert = classmethod(bulk_insert)
+
     def __unicode__(self):
         return '{} {}'.format(self.created, self.user)
 
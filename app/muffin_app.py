@@ -3,12 +3,17 @@
 
 import sys
 import os
+import time
+
+from functools import wraps
 
 import ujson as json
 
 from peewee import IntegrityError
+from playhouse.db_url import connect
 
-from asyncio import coroutine, iscoroutine
+from asyncio import FIRST_COMPLETED, coroutine, ensure_future, iscoroutine, get_event_loop, wait
+from aiohttp.web import HTTPException, StreamResponse, WebSocketResponse
 from muffin import Response, HTTPNotFound, Handler, Application
 from muffin.utils import abcoroutine
 
@@ -18,9 +23,19 @@ sys.path.append(os.path.normpath(BASE_DIR))
 import app
 __package__ = 'app'
 
-from .middlewares import basic_auth_handler, token_auth_handler
-from .utils import OTHER, clean_tags, get_device_and_browser
-from .models import Note, Report, User, Token, NoteBook
+from .aiodb import run, run_auth
+from .compression import OFFLOAD_SIZE, choose_encoding, compress
+from . import metrics
+from .middlewares import basic_auth_handler, basic_username, non_private_zone, token_auth_handler, verified_recently
+from .pagination import (CURSOR_HEADER, OFFSET_HEADER, STREAM_PAGE_SIZE, page_size, page_offset,
+                         encode_cursor, decode_cursor, encode_change_cursor, decode_change_cursor)
+from .utils import USER_AGENT_HEADER, is_browser, is_true, etag, etag_matches
+from .models import Note, Report, User, Token, NoteBook, CursorExpired
+from .bulk import NDJSON, parse_notes, import_notes, summary, ndjson
+from .push import hub
+from .reports import reports
+from .throttle import attempt
+from .words import RESERVED_ALIASES
 
 
 options = dict(
@@ -33,7 +48,8 @@ options = dict(
     # ==============
 
     PEEWEE_MIGRATIONS_PATH='noteit/migrations',
-    PEEWEE_CONNECTION='sqlite:///notes.db',
+    PEEWEE_CONNECTION='sqlite:///' + os.environ.get('NOTES_DB', 'notes.db'),
+    PEEWEE_CONNECTION_MANUAL=True,
 
     LOG_LEVEL='DEBUG',
 )
@@ -61,6 +77,15 @@ def not_auth_token(realm):
     return not_auth(realm, 'Token')
 
 
+def too_many(retry_after):
+    return Response(status=429, headers={'Retry-After': str(retry_after)})
+
+
+def client_address(request):
+    peername = request.transport.get_extra_info('peername') if request.transport else None
+    return peername[0] if peername else None
+
+
 def set_user(request, user):
     request.user = user
 
@@ -70,11 +95,21 @@ def baseauth_middleware_factory(app, handler):
     """ Baseauth authithication middleware factory"""
     @coroutine
     def middleware(request):
-        if hasattr(request, 'user'):
-            response = None
-        else:
-            response = basic_auth_handler(request, get_authorization_header(request),
-                                          not_auth_base, set_user, User)
+        response = None
+        if not hasattr(request, 'user') and not non_private_zone(request):
+            auth = get_authorization_header(request)
+            # a cached header costs one lookup, only the ones that need hashing take the auth pool,
+            # and those are throttled here so a flood is refused before it queues for a thread
+            if verified_recently(auth):
+                response = yield from run(basic_auth_handler, request, auth, not_auth_base, set_user, User)
+            else:
+                username = basic_username(auth)
+                wait = attempt(client_address(request), username) if username is not None else 0
+                if wait:
+                    response = too_many(wait)
+                else:
+                    response = yield from run_auth(basic_auth_handler, request, auth, not_auth_base,
+                                                   set_user, User)
         if not response:
             response = yield from handler(request)
 
@@ -90,20 +125,44 @@ def token_middleware_factory(app, handler):
         if hasattr(request, 'user'):
             response = None
         else:
-            response = token_auth_handler(request, get_authorization_header(request),
-                                          not_auth_token, set_user, Token)
+            response = yield from run(token_auth_handler, request, get_authorization_header(request),
+                                      not_auth_token, set_user, Token)
         if not response:
             response = yield from handler(request)
         return response
     return middleware
 
 
+@coroutine
+def metrics_middleware_factory(app, handler):
+    """ Request latency by route and status """
+    @coroutine
+    def middleware(request):
+        start, status = time.time(), 500
+        try:
+            response = yield from handler(request)
+            status = response.status
+            return response
+        except HTTPException as exc:
+            status = exc.status
+            raise
+        finally:
+            metrics.REQUESTS.observe(time.time() - start, route=metrics.route(request.path),
+                                     method=request.method, status=status)
+    return middleware
+
+
 app = application = Application('noteit', **options)
-app._middlewares.extend([token_middleware_factory, baseauth_middleware_factory])
+app._middlewares.extend([metrics_middleware_factory, token_middleware_factory, baseauth_middleware_factory])
+metrics.instrument_peewee()
 
 
+# Queries run on the aiodb executor threads, where muffin_peewee's task-local connection state
+# does not exist, so the models get a database with plain thread-local connections instead
+database = connect(options['PEEWEE_CONNECTION'])
 for model in [Note, Report, User, Token, NoteBook]:
     app.ps.peewee.register(model)
+    model._meta.database = database
 
 
 class SuperHandler(Handler):
@@ -113,7 +172,11 @@ class SuperHandler(Handler):
         while iscoroutine(response):
             response = yield from response
 
+        if isinstance(response, StreamResponse):
+            return response
+
         status = 200
+        headers = None
 
         if not response:
             response = ''
@@ -122,22 +185,35 @@ class SuperHandler(Handler):
         if isinstance(response, (list, tuple)):
             if len(response) == 2 and isinstance(response[1], int):
                 response, status = response
-
-        if isinstance(response, (dict, )):
-            device, browser = get_device_and_browser(request)
-            if device != OTHER or browser != OTHER:
-                response = clean_tags(response['text'])
+            elif len(response) == 3 and isinstance(response[1], int):
+                response, status, headers = response
 
         if isinstance(response, str):
             response = Response(text=response, content_type='text/html', charset=self.app.cfg.ENCODING)
 
         elif isinstance(response, (list, tuple, dict)):
-            response = Response(text=json.dumps(response), content_type='application/json')
+            with metrics.SERIALIZE.time():
+                response = json.dumps(response)
+            response = Response(text=response, content_type='application/json')
 
         elif isinstance(response, bytes):
             response = Response(body=response, content_type='text/html', charset=self.app.cfg.ENCODING)
 
         response.set_status(status)
+        if headers:
+            response.headers.update(headers)
+
+        if response.status == 200 and 'Content-Encoding' not in response.headers:
+            body = response.body
+            encoding = choose_encoding(request.headers.get('Accept-Encoding'), len(body))
+            if encoding:
+                if len(body) >= OFFLOAD_SIZE:
+                    body = yield from get_event_loop().run_in_executor(None, compress, body, encoding)
+                else:
+                    body = compress(body, encoding)
+                response.body = body
+                response.headers['Content-Encoding'] = encoding
+            response.headers['Vary'] = 'Accept-Encoding'
         return response
 
 
@@ -145,19 +221,79 @@ def get_limit():
     return 50
 
 
+def conditional(method):
+    """ Tag the handler's 200s with the user's notes version, answer 304 before any note is read """
+    @wraps(method)
+    @coroutine
+    def wrapper(self, request, *args, **kwargs):
+        version = yield from run(User.version_of, request.user)
+        tag = etag(request.user.id, version, request.path_qs,
+                   is_browser(request.headers.get(USER_AGENT_HEADER, '')))
+        if etag_matches(request.headers.get('If-None-Match'), tag):
+            response = Response(status=304)
+        else:
+            response = yield from self.make_response(request, method(self, request, *args, **kwargs))
+        if response.status in (200, 304):
+            response.headers['ETag'] = tag
+        return response
+    return wrapper
+
+
 def error(msg, status=400):
     return {'status': 'error', 'error': msg}, status
 
 
+def serialize_page(query, cursor, limit):
+    notes, cursor = Note.page(query, cursor, limit)
+    return [note.as_dict() for note in notes], cursor
+
+
 @app.register('/notes')
 class NotesHandler(SuperHandler):
 
+    def get_query(self, request):
+        return Note.listing(request.user, request.GET.get('notebook'), 'all' in request.GET)
+
     def get(self, request):
-        limit = get_limit()
-        notes = request.user.notes.filter(active=True, notebook=None).limit(limit)
+        if 'all' in request.GET:
+            return (yield from self.stream(request))
+        return (yield from self.page(request))
+
+    @conditional
+    def page(self, request):
+        try:
+            cursor = decode_cursor(request.GET.get('cursor'))
+        except ValueError:
+            return error('Invalid cursor')
+
+        limit = page_size(request.GET.get('limit'), get_limit())
+        notes, cursor = yield from run(serialize_page, self.get_query(request), cursor, limit)
         if not notes:
             return error('No notes', status=204)
-        return [note.as_dict() for note in notes]
+        if cursor:
+            return notes, 200, {CURSOR_HEADER: encode_cursor(cursor)}
+        return notes
+
+    @coroutine
+    def stream(self, request):
+        query = self.get_query(request)
+        notes, cursor = yield from run(serialize_page, query, None, STREAM_PAGE_SIZE)
+        if not notes:
+            return error('No notes', status=204)
+
+        response = StreamResponse(headers={'Content-Type': 'application/json'})
+        yield from response.prepare(request)
+        sep = '['
+        while notes:
+            response.write((sep + ','.join(json.dumps(note) for note in notes)).encode())
+            yield from response.drain()
+            sep = ','
+            if cursor is None:
+                break
+            notes, cursor = yield from run(serialize_page, query, cursor, STREAM_PAGE_SIZE)
+        response.write(b']')
+        yield from response.write_eof()
+        return response
 
     def get_init_data(self, request):
         data = yield from request.post()
@@ -166,68 +302,221 @@ class NotesHandler(SuperHandler):
             'text': data['text'],
         }
         if '_notebook' in data and 'name' not in request.match_info:
-            out['notebook'] = NoteBook.get_or_create(data['_notebook'])[0]
+            out['notebook'] = yield from run(NoteBook.get_or_create, data['_notebook'])
         if 'alias' in data:
             out['alias'] = data.get('alias')
         
         return out
 
     def post(self, request):
+        data = yield from request.post()
+        if data.get('alias') in RESERVED_ALIASES:
+            return error('Alias is reserved')
         create_data = yield from self.get_init_data(request)
+        if create_data.get('alias') and is_true(data.get('_overwrite')):
+            created = yield from run(Note.upsert, **create_data)
+            result = 'created' if created else 'replaced'
+            hub.publish(request.user.id, result, alias=create_data['alias'])
+            return {'status': 'ok', 'result': result}, 201 if created else 200
+        if not create_data.get('alias'):
+            create_data['alias'] = yield from run(Note.free_alias, request.user)
         try:
-            Note.create(**create_data)
+            yield from run(Note.add, **create_data)
         except IntegrityError:
             return error('Alias must be unique', 409)
+        hub.publish(request.user.id, 'created', alias=create_data['alias'])
         return {'status': 'ok'}, 201
 
 
+@app.register('/notes/bulk')
+class BulkHandler(SuperHandler):
+
+    def get(self, request):
+        query = Note.listing(request.user, everything=True)
+        response = StreamResponse(headers={'Content-Type': NDJSON})
+        yield from response.prepare(request)
+        cursor = None
+        while True:
+            notes, cursor = yield from run(serialize_page, query, cursor, STREAM_PAGE_SIZE)
+            response.write(ndjson(notes).encode())
+            yield from response.drain()
+            if cursor is None:
+                break
+        yield from response.write_eof()
+        return response
+
+    def post(self, request):
+        body = yield from request.read()
+        try:
+            items = parse_notes(body)
+        except ValueError as exc:
+            return error(str(exc))
+        try:
+            statuses = yield from run(import_notes, request.user, items)
+        except IntegrityError:
+            return error('Alias must be unique, retry the import', 409)
+        aliases = [status['alias'] for status in statuses if status['status'] == 'created']
+        if aliases:
+            hub.publish(request.user.id, 'imported', aliases=aliases)
+        return summary(statuses)
+
+
+SLOW_CONSUMER = 4000  # close code of dropped subscriptions, the client resyncs with /notes/changes
+
+
+@app.register('/notes/subscribe', methods=['GET'])
+def subscribe_handler(request):
+    """ WebSocket pushing the user's note events """
+    ws = WebSocketResponse()
+    yield from ws.prepare(request)
+    subscription = hub.subscribe(request.user.id)
+    reader = ensure_future(ws.receive())
+    try:
+        while not ws.closed:
+            getter = ensure_future(subscription.get())
+            done, _ = yield from wait([reader, getter], return_when=FIRST_COMPLETED)
+            # both may be done at once, the getter has then already taken its event off the queue
+            if getter in done:
+                event = getter.result()
+                if event is None:
+                    yield from ws.close(code=SLOW_CONSUMER, message=b'Too slow, resync')
+                    break
+                if not ws.closed:
+                    ws.send_str(json.dumps(event))
+            else:
+                getter.cancel()  # still waiting, nothing was taken
+            if reader in done and not ws.closed:  # clients only talk to close
+                reader = ensure_future(ws.receive())
+    finally:
+        reader.cancel()
+        hub.unsubscribe(request.user.id, subscription)
+    return ws
+
+
+def serialize_changes(owner, cursor, limit):
+    notes, cursor = Note.change_page(owner, cursor, limit)
+    return [note.as_change() for note in notes], cursor
+
+
+@app.register('/notes/changes', methods=['GET'])
+class ChangesHandler(SuperHandler):
+
+    def get(self, request):
+        try:
+            cursor = decode_change_cursor(request.GET.get('since'))
+        except ValueError:
+            return error('Invalid cursor')
+        limit = page_size(request.GET.get('limit'), get_limit())
+        try:
+            notes, cursor = yield from run(serialize_changes, request.user, cursor, limit)
+        except CursorExpired:
+            return error('Cursor expired, sync again without since', status=410)
+        headers = {CURSOR_HEADER: encode_change_cursor(cursor)} if cursor else {}
+        if not notes:
+            return error('No changes', status=204) + (headers,)
+        return notes, 200, headers
+
+
+def search_notes(owner, query, limit, offset):
+    return [note.as_dict() for note in Note.search(owner, query, limit, offset)]
+
+
+@app.register('/notes/search', methods=['GET'])
+class SearchHandler(SuperHandler):
+
+    @conditional
+    def get(self, request):
+        query = request.GET.get('q', '').strip()
+        if not query:
+            return error('Query is required')
+        limit = page_size(request.GET.get('limit'), get_limit())
+        offset = page_offset(request.GET.get('offset'))
+        notes = yield from run(search_notes, request.user, query, limit, offset)
+        if not notes:
+            return error('No notes', status=204)
+        if len(notes) == limit:
+            return notes, 200, {OFFSET_HEADER: str(offset + limit)}
+        return notes
+
+
 @app.register('/notes/{alias}')
 class NoteHandler(SuperHandler):
 
-    @property
-    def note(self):
-        alias = self.request.match_info.get('alias')
+    @coroutine
+    def get_note(self, request):
+        alias = request.match_info.get('alias')
         try:
-            return self.request.user.notes.filter(alias=alias, active=True).get()
+            note = yield from run(Note.by_alias(request.user, alias).get)
         except (Note.DoesNotExist, IndexError):
             raise HTTPNotFound
+        return note
 
+    @conditional
     def get(self, request):
-        self.request = request
-        return self.note.as_dict()
+        note = yield from self.get_note(request)
+        if is_browser(request.headers.get(USER_AGENT_HEADER, '')):
+            return note.as_html()
+        return (yield from run(note.as_dict))
 
     def delete(self, request):
-        self.request = request
-        self.note.delete_instance()
+        alias = request.match_info.get('alias')
+        deleted = yield from run(Note.soft_delete, request.user, alias)
+        if not deleted:
+            raise HTTPNotFound
+        hub.publish(request.user.id, 'deleted', alias=alias)
         return {'status': 'ok'}, 204
 
 
+@app.register('/notes/{alias}/restore', methods=['POST'])
+def restore_handler(request):
+    alias = request.match_info.get('alias')
+    restored = yield from run(Note.restore, request.user, alias)
+    if not restored:
+        raise HTTPNotFound
+    hub.publish(request.user.id, 'restored', alias=alias)
+    return {'status': 'ok'}
+
+
+@app.register('/report', methods=['POST'])
+class ReportHandler(SuperHandler):
+
+    def post(self, request):
+        data = yield from request.post()
+        if not data.get('traceback'):
+            return error('No data')
+        if not reports.submit(traceback=data['traceback'], info=request.headers.get(USER_AGENT_HEADER, ''),
+                              user=getattr(request, 'user', None)):
+            return error('Too many reports, try later', 503)
+        return {'status': 'ok'}, 201
+
+
 @app.register('/get_token', methods=['POST'])
 def get_token_handler(request):
-    return {'status': 'ok', 'token': request.user.token.key}
+    token = yield from run(lambda: request.user.token)
+    return {'status': 'ok', 'token': token.key}
 
 
 @app.register('/drop_tokens', methods=['POST'])
 def drop_token_handler(request):
-    request.user.token.delete_instance()
+    yield from run(Token.revoke, request.user)
     return {'status': 'ok'}
 
 
+@app.register('/metrics', methods=['GET'])
+def metrics_handler(request):
+    return Response(text=metrics.expose(), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
 @app.register('/notebook/{name}', methods=['GET', 'POST'])
 class NotebookView(NotesHandler):
 
-    def get(self, request):
-        limit = get_limit()
-        name = request.match_info.get('name')
-        notes = request.user.notes.filter(notebook__name=name, active=True).limit(limit)
-        if not notes:
-            return error('No notes', status=204)
-        return [note.as_dict() for note in notes]
+    def get_query(self, request):
+        return Note.listing(request.user, request.match_info.get('name'))
 
     def get_init_data(self, request):
-        data = super().get_init_data(request)
+        data = yield from super().get_init_data(request)
         name = request.match_info.get('name')
-        data['notebook'] = NoteBook.get_or_create(name)
+        data['notebook'] = yield from run(NoteBook.get_or_create, name)
         return data
 
 
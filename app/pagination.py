@@ -0,0 +1,76 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import base64
+import binascii
+import datetime as dt
+
+import ujson as json
+
+
+CURSOR_HEADER = 'X-Next-Cursor'
+OFFSET_HEADER = 'X-Next-Offset'
+MAX_PAGE_SIZE = 500
+STREAM_PAGE_SIZE = 500
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def page_size(value, default):
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def page_offset(value):
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+def encode_cursor(cursor):
+    """ Opaque representation of a (datetime, id) keyset position """
+    stamp, pk = cursor
+    raw = '{}|{}'.format(stamp.strftime(DATE_FORMAT), pk)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(value):
+    """ Keyset position from its opaque form, ValueError if it is malformed """
+    if not value:
+        return None
+    try:
+        stamp, _, pk = base64.urlsafe_b64decode(value.encode()).decode().partition('|')
+        return dt.datetime.strptime(stamp, DATE_FORMAT), int(pk)
+    except (binascii.Error, TypeError, UnicodeError):
+        raise ValueError('Invalid cursor')
+
+
+def encode_change_cursor(cursor):
+    """ Opaque representation of a (version, id) position in the changes feed """
+    raw = '{}|{}'.format(*cursor)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_change_cursor(value):
+    """ Changes feed position from its opaque form, ValueError if it is malformed """
+    if not value:
+        return None
+    try:
+        version, _, pk = base64.urlsafe_b64decode(value.encode()).decode().partition('|')
+        return int(version), int(pk)
+    except (binascii.Error, TypeError, UnicodeError):
+        raise ValueError('Invalid cursor')
+
+
+def json_stream(pages):
+    """ Chunks of one JSON array built from an iterable of item lists """
+    yield '['
+    sep = ''
+    for items in pages:
+        if items:
+            yield sep + ','.join(json.dumps(item) for item in items)
+            sep = ','
+    yield ']'
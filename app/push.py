@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" In-process fan-out of note events to the live connections of each user
+
+Events are hints ({"event": "deleted", "alias": "..."}), clients fetch the
+notes themselves with /notes/changes. A connection whose queue is full is
+dropped rather than buffered without bound, and resyncs the same way.
+"""
+
+import os
+from asyncio import Future, coroutine
+from collections import deque
+
+from .metrics import collector
+
+
+QUEUE_SIZE = int(os.environ.get('PUSH_QUEUE_SIZE', 100))
+
+
+class Subscription(object):
+    """ Bounded event queue of one connection, kept small since most of them sit idle """
+    __slots__ = ('events', 'size', 'dropped', '_waiter')
+
+    def __init__(self, size=QUEUE_SIZE):
+        self.events = deque()
+        self.size = size
+        self.dropped = False
+        self._waiter = None
+
+    def push(self, event):
+        """ Queue the event, False when the consumer is too far behind """
+        if len(self.events) >= self.size:
+            return False
+        self.events.append(event)
+        self._wake()
+        return True
+
+    def drop(self):
+        self.dropped = True
+        self.events.clear()
+        self._wake()
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    @coroutine
+    def get(self):
+        """ The next event, None once the subscription was dropped """
+        while not self.events and not self.dropped:
+            self._waiter = Future()
+            yield from self._waiter
+        self._waiter = None
+        if self.dropped:
+            return
+        return self.events.popleft()
+
+
+class Hub(object):
+    """ Subscriptions by user id, only touched from the event loop """
+
+    def __init__(self, queue_size=QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.published = self.delivered = self.dropped = 0
+        self._subscriptions = {}
+
+    def __len__(self):
+        return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def subscribe(self, user_id):
+        subscription = Subscription(self.queue_size)
+        self._subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, user_id, subscription):
+        subscriptions = self._subscriptions.get(user_id)
+        if subscriptions is None:
+            return
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del self._subscriptions[user_id]
+
+    def publish(self, user_id, event, **data):
+        """ Send the event to every connection of the user, dropping the slow ones """
+        self.published += 1
+        message = dict(data, event=event)
+        for subscription in list(self._subscriptions.get(user_id, ())):
+            if subscription.push(message):
+                self.delivered += 1
+            else:
+                self.dropped += 1
+                subscription.drop()
+                self.unsubscribe(user_id, subscription)
+
+    def stats(self):
+        return {'subscribers': len(self), 'published': self.published, 'delivered': self.delivered,
+                'dropped': self.dropped}
+
+
+hub = Hub()
+
+
+@collector
+def push_metrics():
+    stats = hub.stats()
+    return [
+        ('noteit_push_subscribers', 'gauge', 'Open push connections.', [({}, stats.pop('subscribers'))]),
+        ('noteit_push_events_total', 'counter', 'Push events by outcome.',
+         [({'outcome': outcome}, value) for outcome, value in sorted(stats.items())]),
+    ]
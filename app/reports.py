@@ -0,0 +1,107 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import atexit
+import datetime as dt
+import logging
+import os
+import queue
+import threading
+import time
+
+from .metrics import collector
+from .models import Report
+
+
+QUEUE_SIZE = int(os.environ.get('REPORT_QUEUE_SIZE', 10000))
+BATCH_SIZE = int(os.environ.get('REPORT_BATCH_SIZE', 200))
+FLUSH_INTERVAL = float(os.environ.get('REPORT_FLUSH_INTERVAL', 2))
+
+logger = logging.getLogger(__name__)
+
+
+class ReportBuffer(object):
+    """ Bounded write-behind queue of client reports, flushed in batches by size or time """
+
+    def __init__(self, size=QUEUE_SIZE, batch_size=BATCH_SIZE, interval=FLUSH_INTERVAL):
+        self.queue = queue.Queue(maxsize=size)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.accepted = self.rejected = self.flushed = self.failed = 0
+        self._thread = None
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+    def submit(self, **report):
+        """ Queue a report, False when the queue is full """
+        self._start()
+        report.setdefault('created', dt.datetime.now())
+        try:
+            self.queue.put_nowait(report)
+        except queue.Full:
+            self.rejected += 1
+            return False
+        self.accepted += 1
+        return True
+
+    def flush(self, block=False):
+        """ Write one batch, waiting up to the interval for it to fill when blocking """
+        batch = []
+        deadline = time.time() + self.interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.time()
+            try:
+                if block and timeout > 0:
+                    batch.append(self.queue.get(timeout=timeout))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            try:
+                Report.bulk_insert(batch)
+            except Exception:
+                self.failed += len(batch)
+                logger.exception('Lost %d reports', len(batch))
+            else:
+                self.flushed += len(batch)
+        return len(batch)
+
+    def close(self):
+        """ Stop the flusher and write whatever is still queued """
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join(self.interval + 1)
+        while self.flush():
+            pass
+
+    def stats(self):
+        return {'queued': self.queue.qsize(), 'accepted': self.accepted, 'rejected': self.rejected,
+                'flushed': self.flushed, 'failed': self.failed}
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='reports')
+                self._thread.daemon = True
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        while not self._closed.is_set():
+            self.flush(block=True)
+
+
+reports = ReportBuffer()
+
+
+@collector
+def report_metrics():
+    stats = reports.stats()
+    return [
+        ('noteit_reports_queued', 'gauge', 'Reports waiting to be written.', [({}, stats.pop('queued'))]),
+        ('noteit_reports_total', 'counter', 'Reports by outcome.',
+         [({'outcome': outcome}, value) for outcome, value in sorted(stats.items())]),
+    ]
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Full-text index of notes: FTS5 on sqlite, tsvector + GIN on postgres
+
+The index is kept in sync by the database itself (sqlite triggers, postgres
+expression index), so every write path of Note is covered.
+
+Django's sqlite schema editor rebuilds the note table for most field changes
+(AddField, AlterField, RemoveField) and the rebuild drops its triggers. Any
+migration that does so has to end with RunPython(create_index, drop_index).
+"""
+
+SQLITE_SETUP = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS note_fts USING fts5("
+    "text, alias, owner_id, content='note', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS note_fts_insert AFTER INSERT ON note BEGIN "
+    "INSERT INTO note_fts(rowid, text, alias, owner_id) VALUES (new.id, new.text, new.alias, new.owner_id); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS note_fts_delete AFTER DELETE ON note BEGIN "
+    "INSERT INTO note_fts(note_fts, rowid, text, alias, owner_id) "
+    "VALUES ('delete', old.id, old.text, old.alias, old.owner_id); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS note_fts_update AFTER UPDATE OF text, alias, owner_id ON note BEGIN "
+    "INSERT INTO note_fts(note_fts, rowid, text, alias, owner_id) "
+    "VALUES ('delete', old.id, old.text, old.alias, old.owner_id); "
+    "INSERT INTO note_fts(rowid, text, alias, owner_id) VALUES (new.id, new.text, new.alias, new.owner_id); "
+    "END",
+    "INSERT INTO note_fts(note_fts) VALUES ('rebuild')",
+]
+SQLITE_TEARDOWN = [
+    "DROP TRIGGER IF EXISTS note_fts_insert",
+    "DROP TRIGGER IF EXISTS note_fts_delete",
+    "DROP TRIGGER IF EXISTS note_fts_update",
+    "DROP TABLE IF EXISTS note_fts",
+]
+
+DOCUMENT = "to_tsvector('simple', alias || ' ' || text)"
+POSTGRES_SETUP = [
+    "CREATE INDEX IF NOT EXISTS note_search ON note USING GIN ({})".format(DOCUMENT),
+]
+POSTGRES_TEARDOWN = [
+    "DROP INDEX IF EXISTS note_search",
+]
+
+SETUP = {'sqlite': SQLITE_SETUP, 'postgresql': POSTGRES_SETUP}
+TEARDOWN = {'sqlite': SQLITE_TEARDOWN, 'postgresql': POSTGRES_TEARDOWN}
+
+
+def create_index(apps, schema_editor):
+    """ Migration step, idempotent: recreates what is missing and refills the sqlite index """
+    for sql in SETUP.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql, None)
+
+
+def drop_index(apps, schema_editor):
+    for sql in TEARDOWN.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql, None)
+
+# Ids of the owner's active notes matching the query, best first
+SEARCH = {
+    'sqlite': "SELECT note.id FROM note_fts JOIN note ON note.id = note_fts.rowid "
+              "WHERE note_fts MATCH %s AND note.active "
+              "ORDER BY bm25(note_fts, 1.0, 2.0, 0.0) LIMIT %s OFFSET %s",
+    'postgresql': "SELECT id FROM note "
+                  "WHERE owner_id = %s AND active AND {doc} @@ plainto_tsquery('simple', %s) "
+                  "ORDER BY ts_rank({doc}, plainto_tsquery('simple', %s)) DESC "
+                  "LIMIT %s OFFSET %s".format(doc=DOCUMENT),
+}
+
+
+def match_query(owner_id, query):
+    """ FTS5 expression: every word of the query, quoted, within the owner's notes """
+    words = ['"{}"'.format(word.replace('"', '""')) for word in query.split()]
+    return 'owner_id:"{}" AND ({})'.format(int(owner_id), ' '.join(words))
+
+
+def search_params(vendor, owner_id, query, limit, offset):
+    if vendor == 'sqlite':
+        return [match_query(owner_id, query), limit, offset]
+    return [owner_id, query, query, limit, offset]
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Token buckets limiting basic auth attempts by client address and by username """
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .metrics import collector
+
+
+class TokenBucket(object):
+    """ Per key buckets of burst tokens refilled at rate per second, the least recent keys are forgotten """
+
+    def __init__(self, rate, burst, size=10000):
+        self.rate = rate
+        self.burst = burst
+        self.size = size
+        self.allowed = 0
+        self.rejected = 0
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key):
+        """ Spend a token of the key, return 0 or the seconds until one is available """
+        if not self.rate:
+            return 0
+        now = time.time()
+        with self._lock:
+            tokens, stamp = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+                self.allowed += 1
+            else:
+                wait = (1 - tokens) / self.rate
+                self.rejected += 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.size:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+addresses = TokenBucket(rate=float(os.environ.get('AUTH_ADDRESS_RATE', 2)),
+                        burst=int(os.environ.get('AUTH_ADDRESS_BURST', 20)))
+usernames = TokenBucket(rate=float(os.environ.get('AUTH_USERNAME_RATE', 0.5)),
+                        burst=int(os.environ.get('AUTH_USERNAME_BURST', 10)))
+
+BUCKETS = {
+    'address': addresses,
+    'username': usernames,
+}
+
+
+def attempt(address, username):
+    """ Seconds the client has to wait before its next attempt, 0 when it may go on """
+    wait = addresses.take(address)
+    if not wait:
+        wait = usernames.take(username)
+    return int(math.ceil(wait))
+
+
+@collector
+def throttle_metrics():
+    return [
+        ('noteit_auth_attempts_total', 'counter', 'Uncached basic auth attempts by limiter and outcome.',
+         [({'limiter': name, 'outcome': outcome}, getattr(bucket, outcome))
+          for name, bucket in sorted(BUCKETS.items()) for outcome in ('allowed', 'rejected')]),
+        ('noteit_auth_throttle_keys', 'gauge', 'Keys tracked by each limiter.',
+         [({'limiter': name}, len(bucket)) for name, bucket in sorted(BUCKETS.items())]),
+    ]
@@ -2,46 +2,104 @@
 # -*- coding: utf-8 -*-
 
 import binascii
+import hashlib
 import os
+import random
 
-import bleach
-import ujson as json
-from faker import Faker
-from user_agents import parse
+from .cache import user_agents
+from .metrics import SANITIZE, timed
+from .words import WORDS
 
-from muffin.utils import generate_password_hash, check_password_hash
 
-
-ALLOWED_TAGS = bleach.ALLOWED_TAGS + ['html', 'body', 'head', 'h1', 'h2', 'h3', 'h4', 'h5', 'pre',
-                                      'meta', 'title', 'div', 'span', 'input', 'label', 'form', 'time',
-                                      'img', 'button', 'tr', 'td', 'table', 'tbody', 'p', 'hr', 'br', 'nav']
+# bleach, user_agents and muffin are heavy to import, they are loaded on first use
+EXTRA_TAGS = ['html', 'body', 'head', 'h1', 'h2', 'h3', 'h4', 'h5', 'pre',
+              'meta', 'title', 'div', 'span', 'input', 'label', 'form', 'time',
+              'img', 'button', 'tr', 'td', 'table', 'tbody', 'p', 'hr', 'br', 'nav']
 ALLOWED_STYLES = ['color']
-
-ALLOWED_ATTRS = {}
-ALLOWED_ATTRS.update(bleach.ALLOWED_ATTRIBUTES)
-ALLOWED_ATTRS.update({
+EXTRA_ATTRS = {
     '*': ['style'],
-})
-fake = Faker()
-
+}
+_markup = {}
 HTTP_HEADER_ENCODING = 'iso-8859-1'
 USER_AGENT_HEADER = 'User-Agent'
 OTHER = 'Other'
 TEMPLATE = '{n.alias}: {n.text}'
 
 
+def is_true(value):
+    """ Form flag read the way Django's BooleanField reads it """
+    return bool(value) and value not in ('0', 'false', 'False')
+
+
 def gen_key():
     return binascii.hexlify(os.urandom(20)).decode()
 
 
 def get_alias():
-    return fake.word()
+    return random.choice(WORDS)
+
+
+def alias_candidates(count=16):
+    """ Distinct plain words first, then numbered ones """
+    words = random.sample(WORDS, count // 2)
+    return words + ['{}-{}'.format(random.choice(WORDS), random.randint(10, 9999))
+                    for _ in range(count - len(words))]
+
+
+def fallback_alias():
+    return '{}-{}'.format(random.choice(WORDS), binascii.hexlify(os.urandom(4)).decode())
+
+
+def generate_password_hash(password):
+    from muffin import utils
+    return utils.generate_password_hash(password)
 
 
+def check_password_hash(password, pwhash):
+    from muffin import utils
+    return utils.check_password_hash(password, pwhash)
+
+
+def allowed_markup():
+    if not _markup:
+        import bleach
+        attrs = dict(bleach.ALLOWED_ATTRIBUTES)
+        attrs.update(EXTRA_ATTRS)
+        _markup.update(tags=bleach.ALLOWED_TAGS + EXTRA_TAGS, attributes=attrs, styles=ALLOWED_STYLES)
+    return _markup
+
+
+@timed(SANITIZE)
 def clean_tags(text):
-    return bleach.clean(text, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRS, styles=ALLOWED_STYLES)
+    import bleach
+    return bleach.clean(text, **allowed_markup())
+
+
+def etag(*parts):
+    """ Weak validator of a representation from what it depends on, e.g. a notes version and the url """
+    return 'W/"{}"'.format(hashlib.sha1(repr(parts).encode('utf-8')).hexdigest())
+
+
+def _opaque_tag(tag):
+    tag = tag.strip()
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def etag_matches(if_none_match, tag):
+    """ Weak comparison of an If-None-Match header against the tag """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return _opaque_tag(tag) in [_opaque_tag(candidate) for candidate in if_none_match.split(',')]
 
 
-def get_device_and_browser(request):
-    ua = parse(request.headers.get(USER_AGENT_HEADER, b''))
-    return ua.device.family, ua.browser.family
+def is_browser(user_agent):
+    """ Is the raw User-Agent header a browser one, memoized """
+    browser = user_agents.get(user_agent)
+    if browser is None:
+        from user_agents import parse
+        ua = parse(user_agent)
+        browser = ua.device.family != OTHER or ua.browser.family != OTHER
+        user_agents.set(user_agent, browser)
+    return browser
@@ -0,0 +1,62 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Precomputed word list for note aliases """
+
+# path segments routed under /notes/, a note with one of these aliases could not be reached
+RESERVED_ALIASES = frozenset(['bulk', 'search', 'changes', 'subscribe'])
+
+WORDS = (
+    'able', 'acid', 'acorn', 'actor', 'aged', 'alarm', 'album', 'alert', 'alley', 'also', 'amber', 'angle',
+    'apple', 'apron', 'area', 'army', 'arrow', 'atlas', 'attic', 'away', 'baby', 'back', 'bacon', 'badge',
+    'ball', 'band', 'bank', 'base', 'basin', 'bath', 'beach', 'bear', 'beard', 'beat', 'beef', 'beer', 'bell',
+    'belt', 'berry', 'best', 'bird', 'blade', 'blank', 'blaze', 'bloom', 'blow', 'blue', 'board', 'boat',
+    'body', 'bold', 'bone', 'book', 'boot', 'born', 'boss', 'both', 'bowl', 'brain', 'brave', 'bread',
+    'brick', 'bride', 'brush', 'burn', 'bush', 'busy', 'cabin', 'cafe', 'cake', 'call', 'calm',
+    'came', 'camel', 'camp', 'candy', 'canoe', 'card', 'care', 'cargo', 'cart', 'case', 'cash', 'cast',
+    'cedar', 'cell', 'chain', 'chalk', 'chat', 'chef', 'chess', 'chest', 'chief', 'chip', 'city', 'clay',
+    'clock', 'cloud', 'club', 'coal', 'coast', 'coat', 'cocoa', 'code', 'cold', 'come', 'cook', 'cool',
+    'cope', 'copy', 'coral', 'core', 'corn', 'cost', 'couch', 'crane', 'creek', 'crew', 'crop', 'crown',
+    'crumb', 'daisy', 'dance', 'dark', 'data', 'date', 'dawn', 'deal', 'dear', 'deck', 'deep', 'deer',
+    'delta', 'desk', 'dial', 'diary', 'diet', 'dish', 'disk', 'dive', 'dock', 'doll', 'door', 'dose', 'down',
+    'draw', 'dream', 'drop', 'drum', 'dual', 'duck', 'dust', 'duty', 'each', 'eagle', 'earn', 'earth', 'ease',
+    'east', 'easy', 'edge', 'elbow', 'else', 'ember', 'even', 'exit', 'fable', 'face', 'fact', 'fair', 'fall',
+    'farm', 'fast', 'fate', 'fear', 'feast', 'feed', 'feel', 'fence', 'fern', 'fiber', 'field', 'file',
+    'fill', 'film', 'find', 'fine', 'fire', 'firm', 'fish', 'flag', 'flame', 'flat', 'flow', 'flute', 'foam',
+    'fold', 'folk', 'food', 'foot', 'forge', 'fork', 'form', 'fort', 'free', 'frog', 'frost', 'fruit', 'fuel',
+    'full', 'fund', 'gain', 'game', 'gate', 'gear', 'ghost', 'giant', 'gift', 'girl', 'glad', 'glow', 'glue',
+    'goal', 'gold', 'golf', 'good', 'grain', 'gram', 'grape', 'grass', 'gray', 'grid', 'grip', 'grow', 'gulf',
+    'hair', 'half', 'hall', 'hand', 'hang', 'hard', 'harm', 'hawk', 'head', 'heat', 'held', 'hero', 'hide',
+    'high', 'hike', 'hill', 'hint', 'hold', 'hole', 'holy', 'home', 'honey', 'hood', 'hook', 'hope', 'horn',
+    'horse', 'host', 'hotel', 'hour', 'house', 'huge', 'hunt', 'idea', 'inch', 'iron', 'item', 'ivory',
+    'jazz', 'jelly', 'jewel', 'join', 'joke', 'judge', 'juice', 'jump', 'jury', 'kayak', 'keen', 'keep',
+    'kind', 'king', 'kite', 'knee', 'knife', 'knot', 'label', 'ladder', 'lake', 'lamb', 'lamp', 'land',
+    'lane', 'last', 'late', 'lava', 'lawn', 'lead', 'leaf', 'lean', 'left', 'lemon', 'lens', 'level', 'life',
+    'lift', 'light', 'like', 'lily', 'lime', 'line', 'linen', 'link', 'lion', 'list', 'live', 'llama', 'load',
+    'loan', 'lock', 'logo', 'long', 'look', 'loop', 'lord', 'loud', 'love', 'luck', 'lunar', 'lung', 'made',
+    'magic', 'mail', 'main', 'make', 'mall', 'malt', 'mango', 'many', 'maple', 'maps', 'march', 'mark',
+    'mask', 'mass', 'mast', 'meal', 'meat', 'medal', 'melon', 'melt', 'memo', 'menu', 'metal', 'mild', 'milk',
+    'mill', 'mind', 'mine', 'mint', 'miss', 'mode', 'model', 'mood', 'moon', 'more', 'moss', 'most', 'moth',
+    'motor', 'mouse', 'move', 'much', 'music', 'nail', 'name', 'navy', 'near', 'neat', 'neck', 'need', 'nest',
+    'news', 'next', 'nice', 'nine', 'node', 'noon', 'nose', 'note', 'novel', 'oak', 'oath', 'ocean', 'olive',
+    'onion', 'open', 'opera', 'orbit', 'otter', 'oval', 'oven', 'over', 'pace', 'pack', 'page', 'pain',
+    'pair', 'palm', 'panda', 'paper', 'park', 'part', 'pass', 'past', 'path', 'peak', 'pear', 'pearl',
+    'pedal', 'piano', 'pick', 'pier', 'pile', 'pilot', 'pine', 'pink', 'pipe', 'pizza', 'plan', 'plane',
+    'plant', 'play', 'plaza', 'plot', 'plug', 'plum', 'poem', 'poet', 'pole', 'pond', 'pool', 'poppy', 'port',
+    'pose', 'post', 'pour', 'pull', 'pump', 'pure', 'push', 'quilt', 'quiz', 'race', 'rack', 'radar', 'radio',
+    'rail', 'rain', 'ramp', 'rank', 'rare', 'rate', 'raven', 'read', 'real', 'reed', 'rent', 'rest', 'rice',
+    'rich', 'ride', 'ring', 'rise', 'risk', 'river', 'road', 'robin', 'rock', 'role', 'roll', 'roof', 'room',
+    'root', 'rope', 'rose', 'ruby', 'rule', 'rush', 'safe', 'sage', 'sail', 'salad', 'salt', 'sand', 'save',
+    'scale', 'scarf', 'seal', 'seat', 'seed', 'seek', 'self', 'sell', 'send', 'shade', 'sheep', 'shelf',
+    'shell', 'ship', 'shoe', 'shop', 'shot', 'show', 'side', 'sign', 'silk', 'sing', 'site', 'size', 'skate',
+    'skin', 'slate', 'slot', 'slow', 'smile', 'snack', 'snow', 'soap', 'sock', 'soft', 'soil', 'solar',
+    'sold', 'song', 'soon', 'sort', 'soup', 'spice', 'spin', 'spoon', 'spot', 'squad', 'stamp', 'star',
+    'stay', 'steam', 'stem', 'step', 'stone', 'stop', 'storm', 'stove', 'sugar', 'suit', 'sunny', 'sure',
+    'swan', 'swim', 'table', 'tail', 'take', 'tale', 'talk', 'tall', 'tank', 'tape', 'task', 'team', 'tent',
+    'term', 'test', 'text', 'tide', 'tiger', 'tile', 'time', 'tiny', 'toast', 'tone', 'tool', 'torch', 'tour',
+    'tower', 'town', 'track', 'trail', 'train', 'tree', 'trip', 'true', 'tube', 'tulip', 'tune', 'turn',
+    'twin', 'type', 'uncle', 'unit', 'vapor', 'vast', 'verb', 'video', 'view', 'vine', 'vinyl', 'violet',
+    'vote', 'wage', 'wagon', 'wait', 'wake', 'walk', 'wall', 'warm', 'wash', 'wave', 'weak', 'wear', 'week',
+    'well', 'west', 'whale', 'wheat', 'wheel', 'wide', 'wild', 'will', 'wind', 'wine', 'wing', 'wire', 'wise',
+    'wish', 'wolf', 'wood', 'wool', 'word', 'work', 'world', 'yacht', 'yard', 'yarn', 'year', 'yoga', 'zebra',
+    'zone', 'zoom',
+)
@@ -0,0 +1,44 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Import time of the alias word list and alias generation throughput
+
+    python benchmarks/aliases.py
+"""
+
+import subprocess
+import sys
+import time
+
+from common import BASE_DIR
+
+
+def import_time(statement, repeat=5):
+    code = 'import time; start = time.time(); {}; print(time.time() - start)'.format(statement)
+    runs = [float(subprocess.check_output([sys.executable, '-c', code], cwd=BASE_DIR, stderr=subprocess.DEVNULL))
+            for _ in range(repeat)]
+    return min(runs) * 1000
+
+
+def throughput(func, seconds=1.0):
+    calls, start = 0, time.time()
+    while time.time() - start < seconds:
+        func()
+        calls += 1
+    return calls / (time.time() - start)
+
+
+def main():
+    from app.utils import alias_candidates, get_alias
+    from app.words import WORDS
+
+    print('word list: {} words, import {:.2f} ms'.format(len(WORDS), import_time('import app.words')))
+    print('get_alias():        {:10.0f} /s'.format(throughput(get_alias)))
+    print('alias_candidates(): {:10.0f} /s'.format(throughput(alias_candidates)))
+    try:
+        print('Faker() import + init: {:.2f} ms'.format(import_time('from faker import Faker; Faker()')))
+    except subprocess.CalledProcessError:
+        print('Faker is not installed, skipping the comparison')
+
+
+if __name__ == '__main__':
+    main()
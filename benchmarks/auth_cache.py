@@ -0,0 +1,36 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Basic auth requests per second with the credentials cache on and off
+
+    python benchmarks/auth_cache.py
+"""
+
+import base64
+
+from common import Request, rate, setup_peewee
+
+
+def main():
+    setup_peewee()
+    from app.cache import credentials
+    from app.middlewares import basic_auth_handler
+    from app.models import User
+
+    header = [b'Basic', base64.b64encode(b'bench:secret')]
+
+    def not_auth(realm):
+        raise AssertionError(realm)
+
+    def call():
+        basic_auth_handler(Request(), header, not_auth, lambda request, user: None, User)
+
+    call()  # register the user
+    size = credentials.size
+    for label, cache_size in (('off', 0), ('on', size)):
+        credentials.clear()
+        credentials.size = cache_size
+        print('cache {:>3}: {:10.0f} req/s'.format(label, rate(call)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Tail latency of token authenticated reads while a flood of basic auth logins runs
+
+Every flood request carries a wrong password, so none of them is served from the
+credentials cache and each one pays a full hash. The flood comes from one address,
+start the server with AUTH_ADDRESS_RATE=0 to measure the hashing pool rather than
+the throttle:
+
+    python app/muffin_app.py run --bind=127.0.0.1:5000 &
+    python benchmarks/auth_flood.py http://127.0.0.1:5000 --clients 32 --flood 64
+"""
+
+import argparse
+import asyncio
+import base64
+import time
+
+import aiohttp
+
+from common import percentile
+from concurrency import get_token
+
+
+@asyncio.coroutine
+def reader(session, url, headers, deadline, latencies):
+    while time.time() < deadline:
+        start = time.time()
+        response = yield from session.get(url + '/notes', headers=headers)
+        yield from response.read()
+        latencies.append(time.time() - start)
+
+
+@asyncio.coroutine
+def login(session, url, deadline, statuses):
+    headers = {'Authorization': 'Basic ' + base64.b64encode(b'bench:wrong').decode()}
+    while time.time() < deadline:
+        response = yield from session.get(url + '/notes', headers=headers)
+        yield from response.read()
+        statuses.append(response.status)
+
+
+@asyncio.coroutine
+def phase(session, url, headers, clients, flood, seconds):
+    latencies, logins = [], []
+    deadline = time.time() + seconds
+    yield from asyncio.gather(*([reader(session, url, headers, deadline, latencies) for _ in range(clients)] +
+                                [login(session, url, deadline, logins) for _ in range(flood)]))
+    return latencies, logins
+
+
+@asyncio.coroutine
+def bench(url, clients, flood, seconds):
+    connector = aiohttp.TCPConnector(limit=clients + flood)
+    session = aiohttp.ClientSession(connector=connector)
+    try:
+        token = yield from get_token(session, url)
+        headers = {'Authorization': 'Token ' + token}
+        for label, logins in (('no flood', 0), ('flood', flood)):
+            latencies, attempts = yield from phase(session, url, headers, clients, logins, seconds)
+            print('{:9} token reads {:6} ({:.0f}/s)  logins {:6} ({:.0f}/s)  p50 {:7.1f} ms  p99 {:7.1f} ms'.format(
+                label, len(latencies), len(latencies) / seconds, len(attempts), len(attempts) / seconds,
+                percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000))
+    finally:
+        session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('url')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--flood', type=int, default=64)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(bench(args.url.rstrip('/'), args.clients, args.flood, args.seconds))
+
+
+if __name__ == '__main__':
+    main()
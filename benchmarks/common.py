@@ -0,0 +1,47 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Shared helpers for the benchmark scripts """
+
+import os
+import sys
+import time
+
+BASE_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(BASE_DIR)
+
+
+def setup_peewee(path=':memory:'):
+    """ Bind the peewee flavour of the models to a fresh sqlite database """
+    import peewee
+    from app import models
+
+    db = peewee.SqliteDatabase(path)
+    tables = [models.User, models.NoteBook, models.Note, models.Token, models.Report]
+    for model in tables:
+        model._meta.database = db
+    db.connect()
+    db.create_tables(tables, safe=True)
+    return db
+
+
+class Request(object):
+    """ Minimal request object understood by the auth handlers """
+
+    def __init__(self, path='/notes'):
+        self.path = path
+
+
+def rate(func, seconds=2.0):
+    """ Call func repeatedly for the given time, return calls per second """
+    calls, start = 0, time.time()
+    while time.time() - start < seconds:
+        func()
+        calls += 1
+    return calls / (time.time() - start)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
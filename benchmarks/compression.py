@@ -0,0 +1,44 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Bytes on the wire and CPU cost of response compression per body size
+
+    python benchmarks/compression.py
+"""
+
+import time
+
+import ujson as json
+
+from common import BASE_DIR  # noqa, puts the repo on the path
+from app import compression
+
+NOTE = {'text': 'Lorem ipsum dolor sit amet, <b>consectetur</b> adipiscing elit. ' * 120,
+        'alias': 'alias', 'notebook': None}
+
+
+def body(notes):
+    return json.dumps([dict(NOTE, alias='alias-{}'.format(i)) for i in range(notes)]).encode()
+
+
+def cost(data, encoding, repeat=20):
+    start = time.time()
+    for _ in range(repeat):
+        out = compression.compress(data, encoding)
+    return len(out), (time.time() - start) / repeat * 1000
+
+
+def main():
+    encodings = ['gzip'] + (['br'] if compression.brotli is not None else [])
+    print('{:>6} {:>10} {:>6} {:>5} {:>10} {:>9}'.format('notes', 'raw bytes', 'coding', 'level', 'wire bytes', 'cpu ms'))
+    for notes in (1, 10, 50, 500):
+        data = body(notes)
+        for encoding in encodings:
+            levels = (1, 6, 9) if encoding == 'gzip' else (compression.BROTLI_QUALITY,)
+            for level in levels:
+                compression.LEVEL = level
+                size, ms = cost(data, encoding)
+                print('{:>6} {:>10} {:>6} {:>5} {:>10} {:>9.2f}'.format(notes, len(data), encoding, level, size, ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Tail latency of token authenticated reads under many concurrent clients
+
+    python app/muffin_app.py run --bind=127.0.0.1:5000 &
+    python benchmarks/concurrency.py http://127.0.0.1:5000 --clients 256
+"""
+
+import argparse
+import asyncio
+import base64
+import time
+
+import aiohttp
+
+from common import percentile
+
+
+@asyncio.coroutine
+def get_token(session, url):
+    auth = 'Basic ' + base64.b64encode(b'bench:secret').decode()
+    response = yield from session.post(url + '/get_token', headers={'Authorization': auth})
+    data = yield from response.json()
+    return data['token']
+
+
+@asyncio.coroutine
+def client(session, url, headers, deadline, latencies, errors):
+    while time.time() < deadline:
+        start = time.time()
+        response = yield from session.get(url + '/notes', headers=headers)
+        yield from response.read()
+        latencies.append(time.time() - start)
+        if response.status >= 400:
+            errors.append(response.status)
+
+
+@asyncio.coroutine
+def bench(url, clients, seconds):
+    connector = aiohttp.TCPConnector(limit=clients)
+    session = aiohttp.ClientSession(connector=connector)
+    try:
+        token = yield from get_token(session, url)
+        headers = {'Authorization': 'Token ' + token}
+        latencies, errors = [], []
+        deadline = time.time() + seconds
+        yield from asyncio.gather(*[client(session, url, headers, deadline, latencies, errors)
+                                    for _ in range(clients)])
+    finally:
+        session.close()
+
+    print('clients {}  requests {}  errors {}  {:.0f} req/s'.format(
+        clients, len(latencies), len(errors), len(latencies) / seconds))
+    for pct in (50, 95, 99, 100):
+        print('  p{:<3} {:8.1f} ms'.format(pct, percentile(latencies, pct) * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('url')
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(bench(args.url.rstrip('/'), args.clients, args.seconds))
+
+
+if __name__ == '__main__':
+    main()
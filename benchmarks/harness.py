@@ -0,0 +1,345 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Load benchmark and conformance check of the Django and muffin backends
+
+Each run starts the backend against a fresh, migrated and seeded sqlite
+database, so the backends are measured and compared on equal terms:
+
+    python benchmarks/harness.py bench django muffin --seconds 30 --clients 16
+    python benchmarks/harness.py check
+    python benchmarks/harness.py queries
+
+The schema comes from the Django migrations, so Django must be installed to
+run either backend here.
+"""
+
+import argparse
+import base64
+import bisect
+import collections
+import http.client
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+from common import BASE_DIR, percentile
+
+BACKENDS = {
+    'django': [sys.executable, os.path.join(BASE_DIR, 'app', 'django_app.py'), 'runserver', '--noreload',
+               '127.0.0.1:{port}'],
+    'muffin': [sys.executable, os.path.join(BASE_DIR, 'app', 'muffin_app.py'), 'run', '--bind',
+               '127.0.0.1:{port}'],
+}
+MIGRATE = [sys.executable, os.path.join(BASE_DIR, 'app', 'django_app.py'), 'migrate', '--noinput']
+FORM = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+
+def basic(username, password='secret'):
+    raw = '{}:{}'.format(username, password).encode()
+    return {'Authorization': 'Basic ' + base64.b64encode(raw).decode()}
+
+
+class Server(object):
+    """ A backend process running against its own sqlite database """
+
+    def __init__(self, backend, port):
+        self.backend = backend
+        self.port = port
+        self.tmp = tempfile.mkdtemp(prefix='noteit-')
+        self.env = dict(os.environ, NOTES_DB=os.path.join(self.tmp, 'notes.db'), DEBUG='off',
+                        ALLOWED_HOSTS='127.0.0.1,localhost')
+        self.process = None
+
+    def __enter__(self):
+        subprocess.check_call(MIGRATE, env=self.env, stdout=subprocess.DEVNULL)
+        command = [part.format(port=self.port) for part in BACKENDS[self.backend]]
+        self.process = subprocess.Popen(command, env=self.env, cwd=self.tmp,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            try:
+                self.request('GET', '/install.sh')
+                return self
+            except OSError:
+                time.sleep(0.2)
+        self.__exit__()
+        raise RuntimeError('{} did not start'.format(self.backend))
+
+    def __exit__(self, *args):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def request(self, method, path, body=None, headers=None):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        try:
+            connection.request(method, path, body=body, headers=headers or {})
+            response = connection.getresponse()
+            return response.status, response.read(), response
+        finally:
+            connection.close()
+
+
+def seed(server, users, notes):
+    """ Register users and bulk import their notes, return {username: token} """
+    tokens = {}
+    for i in range(users):
+        username = 'user{}'.format(i)
+        _, body, _ = server.request('POST', '/get_token', headers=basic(username))
+        tokens[username] = json.loads(body.decode())['token']
+        items = [{'text': 'note {} of {}'.format(n, username), 'alias': 'n{}'.format(n),
+                  'notebook': 'book{}'.format(n % 5) if n % 2 else None} for n in range(notes)]
+        headers = {'Authorization': 'Token ' + tokens[username], 'Content-Type': 'application/json'}
+        server.request('POST', '/notes/bulk', json.dumps(items), headers)
+    return tokens
+
+
+class Workload(object):
+    """ Weighted mix of list, get, create, delete and notebook calls """
+
+    MIX = (
+        ('list (token)', 30),
+        ('list (basic)', 10),
+        ('get', 25),
+        ('notebook', 15),
+        ('create', 12),
+        ('delete', 8),
+    )
+
+    def __init__(self, server, tokens, notes):
+        self.server = server
+        self.tokens = tokens
+        self.notes = notes
+        self.names = [name for name, _ in self.MIX]
+        self.weights = []
+        for _, weight in self.MIX:
+            self.weights.append(weight + (self.weights[-1] if self.weights else 0))
+        self.usernames = sorted(tokens)
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.created = collections.defaultdict(list)
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def call(self, rnd):
+        name = self.names[bisect.bisect(self.weights, rnd.random() * self.weights[-1])]
+        username = rnd.choice(self.usernames)
+        headers = {'Authorization': 'Token ' + self.tokens[username]}
+        if name == 'list (token)':
+            args = ('GET', '/notes', None, headers)
+        elif name == 'list (basic)':
+            args = ('GET', '/notes', None, basic(username))
+        elif name == 'get':
+            args = ('GET', '/notes/n{}'.format(rnd.randrange(self.notes)), None, headers)
+        elif name == 'notebook':
+            args = ('GET', '/notebook/book{}'.format(rnd.randrange(5)), None, headers)
+        elif name == 'create':
+            with self.lock:
+                self.counter += 1
+                alias = 'c{}'.format(self.counter)
+                self.created[username].append(alias)
+            args = ('POST', '/notes', urlencode({'text': 'created', 'alias': alias}), dict(headers, **FORM))
+        else:
+            with self.lock:
+                created = self.created[username]
+                alias = created.pop() if created else 'missing'
+            args = ('DELETE', '/notes/' + alias, None, headers)
+
+        start = time.time()
+        status, _, _ = self.server.request(*args)
+        elapsed = time.time() - start
+        with self.lock:
+            self.latencies[name].append(elapsed)
+            if status >= 500:
+                self.errors[name] += 1
+
+    def run(self, clients, seconds):
+        deadline = time.time() + seconds
+
+        def worker(seed):
+            rnd = random.Random(seed)
+            while time.time() < deadline:
+                self.call(rnd)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def report(self, seconds):
+        print('{:14} {:>8} {:>9} {:>8} {:>8} {:>8} {:>7}'.format(
+            'endpoint', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'))
+        for name in self.names:
+            values = self.latencies[name]
+            print('{:14} {:>8} {:>9.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>7}'.format(
+                name, len(values), len(values) / seconds, percentile(values, 50) * 1000,
+                percentile(values, 95) * 1000, percentile(values, 99) * 1000, self.errors[name]))
+        total = sum(len(values) for values in self.latencies.values())
+        print('{:14} {:>8} {:>9.1f}'.format('total', total, total / seconds))
+
+
+def bench(args):
+    for backend in args.backends:
+        with Server(backend, args.port) as server:
+            tokens = seed(server, args.users, args.notes)
+            workload = Workload(server, tokens, args.notes)
+            workload.run(args.clients, args.seconds)
+            print('\n{} ({} clients, {}s)'.format(backend, args.clients, args.seconds))
+            workload.report(args.seconds)
+
+
+SCENARIO = (
+    ('no auth', 'GET', '/notes', None, {}),
+    ('register', 'POST', '/get_token', None, basic('alice')),
+    ('empty list', 'GET', '/notes', None, basic('alice')),
+    ('create', 'POST', '/notes', urlencode({'text': 'hello', 'alias': 'a1'}), dict(basic('alice'), **FORM)),
+    ('duplicate alias', 'POST', '/notes', urlencode({'text': 'again', 'alias': 'a1'}),
+     dict(basic('alice'), **FORM)),
+    ('reserved alias', 'POST', '/notes', urlencode({'text': 'hidden', 'alias': 'search'}),
+     dict(basic('alice'), **FORM)),
+    ('list', 'GET', '/notes', None, basic('alice')),
+    ('get', 'GET', '/notes/a1', None, basic('alice')),
+    ('create in notebook', 'POST', '/notebook/nb', urlencode({'text': 'in book', 'alias': 'b1'}),
+     dict(basic('alice'), **FORM)),
+    ('notebook', 'GET', '/notebook/nb', None, basic('alice')),
+    ('list ?notebook', 'GET', '/notes?notebook=nb', None, basic('alice')),
+    ('bulk import', 'POST', '/notes/bulk', json.dumps([{'text': 'x', 'alias': 'x1'}, {'text': 'y', 'alias': 'a1'}]),
+     dict(basic('alice'), **{'Content-Type': 'application/json'})),
+    ('overwrite', 'POST', '/notes', urlencode({'text': 'replaced', 'alias': 'x1', '_overwrite': '1'}),
+     dict(basic('alice'), **FORM)),
+    ('overwrite new', 'POST', '/notes', urlencode({'text': 'fresh', 'alias': 'x2', '_overwrite': '1'}),
+     dict(basic('alice'), **FORM)),
+    ('list ?all', 'GET', '/notes?all', None, basic('alice')),
+    ('export', 'GET', '/notes/bulk', None, basic('alice')),
+    ('changes', 'GET', '/notes/changes', None, basic('alice')),
+    ('delete', 'DELETE', '/notes/a1', None, basic('alice')),
+    ('get deleted', 'GET', '/notes/a1', None, basic('alice')),
+    ('restore', 'POST', '/notes/a1/restore', None, basic('alice')),
+    ('get restored', 'GET', '/notes/a1', None, basic('alice')),
+    ('delete again', 'DELETE', '/notes/a1', None, basic('alice')),
+    ('reuse deleted alias', 'POST', '/notes', urlencode({'text': 'reborn', 'alias': 'a1'}),
+     dict(basic('alice'), **FORM)),
+    ('wrong password', 'GET', '/notes', None, basic('alice', 'wrong')),
+    ('other user', 'GET', '/notes/x1', None, basic('bob')),
+    ('report', 'POST', '/report', urlencode({'traceback': 'boom'}), FORM),
+    ('drop tokens', 'POST', '/drop_tokens', None, basic('alice')),
+)
+
+
+def normalize(body):
+    """ JSON bodies compared by value with volatile fields blanked, others by emptiness """
+    try:
+        data = json.loads(body.decode())
+    except ValueError:
+        return '<{} bytes>'.format(len(body)) if body else ''
+    if isinstance(data, dict) and 'token' in data:
+        data['token'] = '<token>'
+    return data
+
+
+def conformance(backend, port):
+    results = []
+    with Server(backend, port) as server:
+        for name, method, path, body, headers in SCENARIO:
+            status, content, _ = server.request(method, path, body, headers)
+            results.append((name, status, normalize(content)))
+    return results
+
+
+def check(args):
+    first, second = [conformance(backend, args.port) for backend in ('django', 'muffin')]
+    failures = 0
+    for (name, *django), (_, *muffin) in zip(first, second):
+        same = django == muffin
+        failures += not same
+        print('{:4} {:20} django {} | muffin {}'.format('ok' if same else 'DIFF', name, django[0], muffin[0]))
+        if not same:
+            print('     django {!r}\n     muffin {!r}'.format(django[1], muffin[1]))
+    print('{} of {} steps differ'.format(failures, len(first)))
+    return 1 if failures else 0
+
+
+# Exact number of queries behind each read, with the token already cached
+QUERY_BUDGET = (
+    ('list', '/notes', 2),
+    ('list ?all', '/notes?all', 1),
+    ('list ?notebook', '/notes?notebook=book1', 2),
+    ('notebook', '/notebook/book1', 2),
+    ('get', '/notes/n1', 2),
+    ('search', '/notes/search?q=note', 3),
+    ('export', '/notes/bulk', 1),
+    ('changes', '/notes/changes', 1),
+)
+# conditional GETs are answered by the notes version lookup alone
+REVALIDATE = ('/notes', '/notebook/book1', '/notes/n1', '/notes/search?q=note')
+QUERY_COUNT = 'noteit_db_query_duration_seconds_count '
+
+
+def query_count(server):
+    _, body, _ = server.request('GET', '/metrics')
+    for line in body.decode().splitlines():
+        if line.startswith(QUERY_COUNT):
+            return int(line[len(QUERY_COUNT):])
+    return 0
+
+
+def queries(args):
+    """ Count the queries behind every read endpoint, fail when any differs from the expected count """
+    failures = 0
+    for backend in sorted(BACKENDS):
+        with Server(backend, args.port) as server:
+            tokens = seed(server, 1, 100)
+            headers = {'Authorization': 'Token ' + tokens['user0']}
+            for name, path, budget in QUERY_BUDGET:
+                server.request('GET', path, headers=headers)  # warm the caches
+                before = query_count(server)
+                server.request('GET', path, headers=headers)
+                count = query_count(server) - before
+                failures += count != budget
+                print('{:4} {:7} {:16} {} queries, expected {}'.format(
+                    'ok' if count == budget else 'FAIL', backend, name, count, budget))
+            for path in REVALIDATE:
+                _, _, response = server.request('GET', path, headers=headers)
+                conditional = dict(headers, **{'If-None-Match': response.getheader('ETag', '')})
+                before = query_count(server)
+                status, _, _ = server.request('GET', path, headers=conditional)
+                count = query_count(server) - before
+                failures += status != 304 or count != 1
+                print('{:4} {:7} {:16} {} {} with {} queries, expected 304 with 1'.format(
+                    'ok' if status == 304 and count == 1 else 'FAIL', backend, 'revalidate', path, status, count))
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8765)
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    bench_parser = commands.add_parser('bench')
+    bench_parser.add_argument('backends', nargs='+', choices=sorted(BACKENDS))
+    bench_parser.add_argument('--clients', type=int, default=8)
+    bench_parser.add_argument('--seconds', type=float, default=20)
+    bench_parser.add_argument('--users', type=int, default=20)
+    bench_parser.add_argument('--notes', type=int, default=100)
+    commands.add_parser('check')
+    commands.add_parser('queries')
+    args = parser.parse_args()
+    if args.command == 'bench':
+        bench(args)
+    elif args.command == 'queries':
+        sys.exit(queries(args))
+    else:
+        sys.exit(check(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Cost of the request instrumentation, per observation and per request
+
+    python benchmarks/metrics_overhead.py
+"""
+
+import time
+
+from common import BASE_DIR  # noqa, puts the repo on the path
+from app import metrics
+
+# observations made while serving one typical token authenticated listing
+PER_REQUEST = 4
+
+
+def per_call(func, repeat=200000):
+    start = time.time()
+    for _ in range(repeat):
+        func()
+    return (time.time() - start) / repeat * 1e6
+
+
+def main():
+    histogram = metrics.Histogram('bench_seconds', 'Benchmark histogram.')
+
+    def observe():
+        histogram.observe(0.003, route='/notes', method='GET', status=200)
+
+    def context():
+        with histogram.time(step='hash'):
+            pass
+
+    wrapped = metrics.timed(histogram, step='lookup')(lambda: None)
+    observe_us = per_call(observe)
+    print('observe():        {:6.2f} us'.format(observe_us))
+    print('timer context:    {:6.2f} us'.format(per_call(context)))
+    print('timed decorator:  {:6.2f} us'.format(per_call(wrapped)))
+    print('route label:      {:6.2f} us'.format(per_call(lambda: metrics.route('/notes/some-alias'))))
+    print('per request (~{} observations): {:.1f} us'.format(PER_REQUEST, observe_us * PER_REQUEST))
+    start = time.time()
+    body = metrics.expose()
+    print('/metrics render:  {:6.2f} ms, {} bytes'.format((time.time() - start) * 1000, len(body)))
+
+
+if __name__ == '__main__':
+    main()
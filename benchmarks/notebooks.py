@@ -0,0 +1,42 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Write throughput of a notebook-heavy workload with the name cache on and off
+
+    python benchmarks/notebooks.py [--notes 20000] [--notebooks 50]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from common import setup_peewee
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--notes', type=int, default=20000)
+    parser.add_argument('--notebooks', type=int, default=50)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    db = setup_peewee(path)
+    from app.cache import notebooks
+    from app.models import Note, NoteBook, User
+
+    user = User.create(username='bench', password='')
+    size = notebooks.size
+    for label, cache_size in (('off', 0), ('on', size)):
+        notebooks.clear()
+        notebooks.size = cache_size
+        start = time.time()
+        with db.atomic():
+            for i in range(args.notes):
+                notebook = NoteBook.get_or_create('notebook-{}'.format(i % args.notebooks))
+                Note.create(owner=user, text='text', alias='{}-{}'.format(label, i), notebook=notebook)
+        elapsed = time.time() - start
+        print('cache {:>3}: {:8.0f} notes/s'.format(label, args.notes / elapsed))
+
+
+if __name__ == '__main__':
+    main()
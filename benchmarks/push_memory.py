@@ -0,0 +1,105 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Server memory held by idle push subscribers
+
+Opens idle WebSocket subscriptions against a running muffin backend and
+reads the growth of its resident memory from /proc:
+
+    ulimit -n 20000; python app/muffin_app.py run --bind=127.0.0.1:5000 &
+    python benchmarks/push_memory.py http://127.0.0.1:5000 $! --subscribers 10000
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+
+import aiohttp
+
+from concurrency import get_token
+
+
+def children(pid):
+    """ Pids of the direct children, the gunicorn workers when pid is the master """
+    pids = []
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            try:
+                with open('/proc/{}/stat'.format(name)) as stat:
+                    fields = stat.read().rpartition(')')[2].split()
+            except (IOError, OSError):
+                continue
+            if int(fields[1]) == pid:
+                pids.append(int(name))
+    return pids
+
+
+def rss(pid):
+    """ Resident memory of the process and its children, in KiB """
+    total = 0
+    for process in [pid] + children(pid):
+        with open('/proc/{}/status'.format(process)) as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    total += int(line.split()[1])
+    return total
+
+
+@asyncio.coroutine
+def subscribers(url):
+    session = aiohttp.ClientSession()  # not the subscribers' one, its sockets are all upgraded
+    try:
+        response = yield from session.get(url + '/metrics')
+        body = yield from response.text()
+    finally:
+        session.close()
+    for line in body.splitlines():
+        if line.startswith('noteit_push_subscribers '):
+            return int(float(line.split()[1]))
+
+
+@asyncio.coroutine
+def bench(url, pid, count, batch):
+    session = aiohttp.ClientSession()
+    try:
+        token = yield from get_token(session, url)
+    finally:
+        session.close()
+    # ws_connect of the aiohttp muffin pins takes no headers, the session sends them; no connection
+    # limit either, upgraded sockets never go back to the pool and would stall the batches
+    session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=None),
+                                    headers={'Authorization': 'Token ' + token})
+    sockets = []
+    try:
+        before = rss(pid)
+        while len(sockets) < count:
+            size = min(batch, count - len(sockets))
+            sockets.extend((yield from asyncio.gather(*[
+                session.ws_connect(url + '/notes/subscribe') for _ in range(size)])))
+        yield from asyncio.sleep(1)
+        after = rss(pid)
+        open_ = yield from subscribers(url)
+        print('subscribers {}  server rss {:.1f} -> {:.1f} MiB  {:.1f} KiB per subscriber'.format(
+            open_, before / 1024.0, after / 1024.0, float(after - before) / max(open_ or count, 1)))
+    finally:
+        for ws in sockets:
+            yield from ws.close()
+        session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('url')
+    parser.add_argument('pid', type=int, help='pid of the server process')
+    parser.add_argument('--subscribers', type=int, default=10000)
+    parser.add_argument('--batch', type=int, default=200)
+    args = parser.parse_args()
+    # every subscriber is a socket on both ends, give the server the same headroom (ulimit -n)
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    asyncio.get_event_loop().run_until_complete(
+        bench(args.url.rstrip('/'), args.pid, args.subscribers, args.batch))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Browser read latency of a large note: sanitize on read vs stored rendition
+
+    python benchmarks/sanitize.py
+"""
+
+from common import rate, setup_peewee
+
+TEXT = ('<div style="color: red">note <b>text</b> <script>alert(1)</script></div>\n' * 200)[:2**13-1]
+
+
+def main():
+    setup_peewee()
+    from app.models import Note, User
+
+    user = User.create(username='bench', password='')
+    Note.create(owner=user, alias='big', text=TEXT)
+    Note.update(html=None).where(Note.alias == 'big').execute()
+
+    def read():
+        return Note.get(Note.alias == 'big').as_html()
+
+    before = rate(read)
+    Note.backfill_html(100)
+    after = rate(read)
+    print('note size {} chars'.format(len(TEXT)))
+    print('sanitize on read: {:8.3f} ms/read'.format(1000 / before))
+    print('stored html:      {:8.3f} ms/read'.format(1000 / after))
+
+
+if __name__ == '__main__':
+    main()
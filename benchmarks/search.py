@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Latency of full-text note search over a large corpus
+
+Builds a sqlite database with the same index and query the app uses, then
+times searches of one owner's notes:
+
+    python benchmarks/search.py [--notes 1000000] [--owners 1000] [--queries 500]
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from common import percentile
+from app.search import SEARCH, SQLITE_SETUP, search_params
+from app.words import WORDS
+
+SCHEMA = ("CREATE TABLE note (id INTEGER PRIMARY KEY, text TEXT NOT NULL, alias VARCHAR(30) NOT NULL, "
+          "owner_id INTEGER NOT NULL, active BOOLEAN NOT NULL DEFAULT 1)")
+
+
+def sentence(rnd, length=12):
+    return ' '.join(rnd.choice(WORDS) for _ in range(length))
+
+
+def build(path, notes, owners):
+    db = sqlite3.connect(path)
+    db.execute(SCHEMA)
+    for sql in SQLITE_SETUP:
+        db.execute(sql)
+    rnd = random.Random(0)
+    rows = ((sentence(rnd), 'n{}'.format(i), i % owners, i % 20 != 0) for i in range(notes))
+    with db:
+        db.executemany('INSERT INTO note (text, alias, owner_id, active) VALUES (?, ?, ?, ?)', rows)
+    return db
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--notes', type=int, default=1000000)
+    parser.add_argument('--owners', type=int, default=1000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args()
+
+    start = time.time()
+    db = build(os.path.join(tempfile.mkdtemp(), 'search.db'), args.notes, args.owners)
+    print('indexed {} notes in {:.1f}s'.format(args.notes, time.time() - start))
+
+    sql = SEARCH['sqlite'].replace('%s', '?')
+    rnd = random.Random(1)
+    for words in (1, 2, 3):
+        latencies, found = [], 0
+        for _ in range(args.queries):
+            query = ' '.join(rnd.choice(WORDS) for _ in range(words))
+            params = search_params('sqlite', rnd.randrange(args.owners), query, args.limit, 0)
+            start = time.time()
+            found += len(db.execute(sql, params).fetchall())
+            latencies.append(time.time() - start)
+        print('{} word(s): p50 {:6.2f} ms  p95 {:6.2f} ms  {:5.1f} hits/query'.format(
+            words, percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000,
+            float(found) / args.queries))
+
+
+if __name__ == '__main__':
+    main()
@@ -21,8 +21,12 @@ if __name__ == "__main__":
     import app
     __package__ = 'app'
 
+    from app.commands import COMMANDS, run_command
 
-    if _type == 'django':
+    if len(sys.argv) > 2 and sys.argv[2] in COMMANDS:
+        run_command('app.' + APPS[_type], sys.argv[2], sys.argv[3:])
+
+    elif _type == 'django':
         os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings.local")
         from django.core.management import execute_from_command_line
 